@@ -0,0 +1,79 @@
+# 🖼️ โลโก้/ฟอนต์ของหน้าเว็บ เสิร์ฟจากเครื่องเอง (โฟลเดอร์ static/ ผ่าน server.enableStaticServing ใน .streamlit/config.toml)
+# - ไม่ต้องออกเน็ตไป fonts.googleapis.com / raw.githubusercontent.com ตอนเปิดหน้า (เน็ตโรงพยาบาลช้า/ถูกกรองก็ไม่ค้าง)
+# - URL ต่อท้าย ?v=<hash ของไฟล์> -> server ส่ง Cache-Control อายุยาว เบราว์เซอร์โหลดครั้งเดียว เปลี่ยนไฟล์เมื่อไหร่ hash เปลี่ยนเอง
+# - ฟอนต์ Sarabun (400/500/700) เก็บไว้ใน repo ที่ static/fonts/ เป็น woff2 ตัดเหลือเฉพาะอักษรไทย + ละติน (~20 KB ต่อน้ำหนัก)
+#   ไฟล์ต้นฉบับจาก Google Fonts (SIL OFL 1.1 ดู static/fonts/OFL.txt) สร้างใหม่ได้ด้วย  python assets.py fonts  (สำหรับผู้ดูแล ต้องมี fonttools + brotli)
+#   เครื่องที่ลง Sarabun ไว้แล้วใช้ของในเครื่องก่อน (local()) ไม่ต้องโหลดเลย
+# ตั้ง SSW_ASSETS=cdn เพื่อกลับไปใช้ Google Fonts + โลโก้จาก GitHub แบบเดิม
+import argparse
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+import urllib.request
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+MODE = os.environ.get("SSW_ASSETS", "local")
+LOGO = "ssw_logo.jpg"
+LOGO_CDN = "https://raw.githubusercontent.com/mfgssw-ops/smart-pharmacy-ssw/main/SSW_Logo.jpg"
+FONTS_CDN = "@import url('https://fonts.googleapis.com/css2?family=Sarabun:wght@400;500;700&family=Prompt:wght@400;500;700&display=swap');"
+FONT_WEIGHTS = {400: "Regular", 500: "Medium", 700: "Bold"}
+FONT_SOURCE = "https://raw.githubusercontent.com/google/fonts/main/ofl/sarabun/{}"
+# อักษรที่เก็บไว้ในไฟล์ฟอนต์: ละติน + Latin-1, ไทย (รวม ฿), เครื่องหมายวรรคตอน, € และวงกลมประ (ใช้วางสระ/วรรณยุกต์ลอย)
+FONT_UNICODES = "U+0000-00FF,U+0E00-0E7F,U+2000-206F,U+20AC,U+2212,U+25CC"
+
+
+@functools.lru_cache(maxsize=None)
+def url(name):
+    # ที่อยู่ไฟล์ใน static/ สำหรับ <img>/<style> ในหน้าเว็บ (None = ไม่มีไฟล์)
+    path = os.path.join(STATIC_DIR, name)
+    if not os.path.exists(path): return None
+    with open(path, 'rb') as f: v = hashlib.blake2b(f.read(), digest_size=6).hexdigest()
+    return f"app/static/{name}?v={v}"
+
+def logo_url():
+    return LOGO_CDN if MODE == "cdn" else (url(LOGO) or LOGO_CDN)
+
+@functools.lru_cache(maxsize=None)
+def font_css():
+    if MODE == "cdn": return FONTS_CDN
+    # local() ก่อน: เครื่องที่ลงฟอนต์ไว้แล้วไม่ต้องโหลดเลย (ไม่มีไฟล์ใน static/ -> ใช้ฟอนต์ไทยในเครื่องตาม font-family ของหน้าเว็บ)
+    faces = [f"@font-face {{ font-family: 'Sarabun'; font-weight: {w}; font-display: swap; "
+             f"src: local('Sarabun {name}'), local('Sarabun-{name}'), url('{url(f'fonts/Sarabun-{name}.woff2')}') format('woff2'); }}"
+             for w, name in FONT_WEIGHTS.items() if url(f"fonts/Sarabun-{name}.woff2")]
+    return "\n".join(faces)
+
+
+# --- เตรียมไฟล์ (ผู้ดูแลรันเองแล้ว commit ผลลัพธ์ แอปไม่ได้เรียก) ---
+def make_fonts(src=None):
+    # src = โฟลเดอร์ที่มี Sarabun-*.ttf อยู่แล้ว (เช่นแตกมาจาก google/fonts) ไม่ระบุ = โหลดจาก GitHub
+    from fontTools import subset
+    out = os.path.join(STATIC_DIR, "fonts")
+    os.makedirs(out, exist_ok=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in FONT_WEIGHTS.values():
+            ttf = os.path.join(src, f"Sarabun-{name}.ttf") if src else os.path.join(tmp, f"Sarabun-{name}.ttf")
+            if not src: urllib.request.urlretrieve(FONT_SOURCE.format(f"Sarabun-{name}.ttf"), ttf)
+            dest = os.path.join(out, f"Sarabun-{name}.woff2")
+            # เก็บ layout feature ครบ (mark/mkmk/ccmp) ไม่งั้นสระบน/วรรณยุกต์ซ้อนกันผิดที่
+            subset.main([ttf, f"--unicodes={FONT_UNICODES}", "--layout-features=*", "--flavor=woff2", f"--output-file={dest}"])
+            print(f"✅ {dest} ({os.path.getsize(dest) // 1024} KB)")
+        lic = os.path.join(src, "OFL.txt") if src else os.path.join(tmp, "OFL.txt")
+        if not src: urllib.request.urlretrieve(FONT_SOURCE.format("OFL.txt"), lic)
+        if os.path.exists(lic): shutil.copyfile(lic, os.path.join(out, "OFL.txt"))
+
+def make_logo(src="SSW_Logo.jpg", size=170):
+    # ย่อโลโก้ให้พอดีที่แสดงจริง (~85px, x2 สำหรับจอความละเอียดสูง) จาก 1760px / 145 KB
+    from PIL import Image
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    with Image.open(src) as im:
+        im.convert("RGB").resize((size, size), Image.LANCZOS).save(os.path.join(STATIC_DIR, LOGO), quality=85, optimize=True)
+    print(f"✅ {os.path.join(STATIC_DIR, LOGO)} ({os.path.getsize(os.path.join(STATIC_DIR, LOGO)) // 1024} KB)")
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description="เตรียมโลโก้/ฟอนต์ไว้ในโฟลเดอร์ static/ ให้แอปเสิร์ฟเอง")
+    ap.add_argument('command', choices=['fonts', 'logo'])
+    ap.add_argument('--src', help="fonts: โฟลเดอร์ที่มีไฟล์ Sarabun-*.ttf + OFL.txt (ไม่ระบุ = โหลดจาก GitHub)")
+    args = ap.parse_args()
+    make_fonts(args.src) if args.command == 'fonts' else make_logo()
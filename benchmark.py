@@ -0,0 +1,306 @@
+# ⏱️ วัดความเร็วเส้นทางข้อมูลหลักของแอป (ไม่ต้องต่อเน็ต ไม่ต้องเปิด streamlit)
+# สร้างข้อมูลจำลอง -> ชีตปลอมที่เลียนแบบ gspread -> ดึง/อ่าน/เตรียมข้อมูล/แจ้งเตือน/กราฟ/FEFO/บันทึก/ส่งขึ้นชีต
+# ผลลัพธ์เป็น JSON (เรียง key แล้ว) เอาไว้ diff เทียบระหว่างเวอร์ชัน เช่น
+#   python benchmark.py --wards 10 --drugs 80 --batches 20000 --out bench_before.json
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import inventory
+import redistribute
+import stock_ops
+import storage
+
+STOCK_HEADER = ["Date_Produced", "Drug_Name", "Batch_ID", "Qty", "Expiry_Date", "Location", "Status", "Is_Saved", "Action_By", "Record_Status"]
+CHART_TOP_N = 20  # ค่าเริ่มต้นของกราฟภาพรวมในแอป (dashboard.CHART_TOP_N ตัวที่เลือกไว้ก่อน)
+
+
+# --- 1. ข้อมูลจำลอง ---
+def generate(wards=8, drugs=60, batches=5000, history_months=6, history_rows=None, frozen_ratio=0.3, seed=1, today=None):
+    # คืน {ชื่อแท็บ: values (แถวแรก = หัวตาราง)} หน้าตาเหมือนไฟล์จริง
+    #   Stock = ล็อตที่อยู่ในตู้ batches แถว, History_YYYY_MM = จ่าย/ทิ้งย้อนหลัง history_months เดือน (เดือนละ history_rows แถว)
+    rnd = random.Random(seed)
+    today = (today or datetime.now()).date()
+    history_rows = batches if history_rows is None else history_rows
+    ward_names = [f"Ward {i:02d}" for i in range(wards)]
+    drug_rows = [[f"Extemp {i:03d}", str(rnd.randint(5, 400)), "Frozen" if rnd.random() < frozen_ratio else "Room", str(rnd.choice([7, 14, 30]))]
+                 for i in range(drugs)]
+    frozen = {r[0] for r in drug_rows if r[2] == "Frozen"}
+    serial = iter(range(10 ** 9))
+
+    def lot(produced, status):
+        name = rnd.choice(drug_rows)[0]
+        expiry = produced + timedelta(days=rnd.randint(3, 120))
+        state = ("Frozen" if rnd.random() < 0.7 else "Thawed") if name in frozen else rnd.choice(["Active", "Active", "Transferred"])
+        return [produced.isoformat(), name, f"BX{next(serial):07d}", str(rnd.randint(1, 40)), expiry.isoformat(),
+                rnd.choice(ward_names), state, "TRUE", "bench", status]
+
+    tables = {
+        "Drugs": [["Drug_Name", "Unit_Cost", "Type", "BUD_Cold"]] + drug_rows,
+        "Locations": [["Location"]] + [[w] for w in ward_names],
+        "Users": [["Username", "Password", "Name", "Role"], ["bench", "bench", "Bench", "admin"]],
+        "Stock": [STOCK_HEADER] + [lot(today - timedelta(days=rnd.randint(0, 60)), "In_Stock") for _ in range(batches)],
+    }
+    for m in range(history_months):
+        month = (pd.Timestamp(today).to_period('M') - m - 1)
+        days = month.days_in_month
+        rows = [lot(month.start_time.date() + timedelta(days=rnd.randrange(days)), rnd.choice(storage.HISTORY_STATUSES)) for _ in range(history_rows)]
+        tables[f"{storage.HISTORY_PREFIX}{month.year}_{month.month:02d}"] = [STOCK_HEADER] + rows
+    return tables
+
+
+# --- 2. ชีตปลอมแบบ gspread (ให้ SheetsBackend ตัวจริงทำงานได้โดยไม่ต้องต่อเน็ต) ---
+class FakeWorksheet:
+    def __init__(self, book, title, values):
+        self.book = book
+        self.title = title
+        self.id = len(book.sheets)
+        self.values = [list(r) for r in values]
+
+    def _rows(self, a1):
+        # "A5" / "A5:J9" -> (แถวเริ่ม, แถวจบ) แบบนับจาก 0
+        cells = a1.split(':')
+        row = lambda c: int(''.join(ch for ch in c if ch.isdigit()) or 0) - 1
+        return row(cells[0]), row(cells[-1])
+
+    def update(self, values, range_name='A1'):
+        self.book.request(('update', self.title))
+        start, _ = self._rows(range_name)
+        self.values += [[] for _ in range(start + len(values) - len(self.values))]
+        for k, row in enumerate(values): self.values[start + k] = list(row)
+
+    def batch_update(self, data):
+        self.book.request(('values_batch_update', self.title))
+        for d in data:
+            start, _ = self._rows(d['range'])
+            for k, row in enumerate(d['values']): self.values[start + k] = list(row)
+
+    def append_rows(self, values, table_range='A1'):
+        self.book.request(('append_rows', self.title))
+        self.values += [list(r) for r in values]
+
+    def batch_clear(self, ranges):
+        self.book.request(('batch_clear', self.title))
+        # ใช้แค่ตอนเขียนทับทั้งแผ่น: "A{n}:ZZ" = ล้างตั้งแต่แถว n ลงไป
+        for r in ranges:
+            if r.startswith('A') and r.endswith(':ZZ'): del self.values[self._rows(r)[0]:]
+
+
+class FakeSpreadsheet:
+    # faults = ฟังก์ชันที่โยน error ใส่บางคำขอ (storage.quota_faults) เลียนแบบโควตาเต็มตอนมีคนใช้พร้อมกันหลายคน
+    def __init__(self, tables, faults=None):
+        self.sheets = {}
+        self.calls = []
+        self.faults = faults
+        for title, values in tables.items(): self.sheets[title] = FakeWorksheet(self, title, values)
+
+    def request(self, call):
+        self.calls.append(call)
+        if self.faults: self.faults(call[0])
+
+    def worksheets(self):
+        return list(self.sheets.values())
+
+    def add_worksheet(self, title, rows, cols):
+        self.request(('add_worksheet', title))
+        self.sheets[title] = FakeWorksheet(self, title, [])
+        return self.sheets[title]
+
+    def values_batch_get(self, ranges):
+        self.request(('values_batch_get', len(ranges)))
+        # "'แท็บ'" = ทั้งแท็บ, "'แท็บ'!A:C" = เฉพาะคอลัมน์ A-C
+        out = []
+        for r in ranges:
+            name, _, cols = r.partition('!')
+            width = ord(cols.split(':')[-1]) - 64 if cols else None
+            out.append({'values': [list(v[:width]) for v in self.sheets[name.strip("'")].values]})
+        return {'valueRanges': out}
+
+    def batch_update(self, body):
+        self.request(('batch_update', len(body['requests'])))
+        by_id = {ws.id: ws for ws in self.sheets.values()}
+        for req in body['requests']:
+            rng = req['deleteDimension']['range']
+            del by_id[rng['sheetId']].values[rng['startIndex']:rng['endIndex']]
+
+
+class FakeClient:
+    def __init__(self, tables, faults=None):
+        self.book = FakeSpreadsheet(tables, faults)
+
+    def open_by_key(self, key):
+        return self.book
+
+
+# --- 3. วัดผล ---
+def percentiles(samples):
+    s = pd.Series(samples) * 1000
+    return {'n': len(s), 'mean_ms': s.mean(), 'min_ms': s.min(), 'p50_ms': s.quantile(0.5),
+            'p90_ms': s.quantile(0.9), 'p99_ms': s.quantile(0.99), 'max_ms': s.max()}
+
+class Stages:
+    # จับเวลาแต่ละขั้นหลายรอบ + วัดหน่วยความจำสูงสุด (tracemalloc) ในรอบแยก เพื่อไม่ให้ถ่วงตัวเลขเวลา
+    # ขั้นที่ทำซ้ำกับข้อมูลเดิมไม่ได้ (บันทึก/ส่งขึ้นชีต) ให้ rerun=False: รอบแรกวัดหน่วยความจำอย่างเดียว รอบต่อไปจับเวลา
+    def __init__(self):
+        self.times, self.peak = {}, {}
+
+    def run(self, name, fn, rerun=True):
+        if name not in self.peak:
+            tracemalloc.start()
+            out = fn()
+            self.peak[name] = tracemalloc.get_traced_memory()[1] / 1024
+            tracemalloc.stop()
+            if not rerun: return out
+        t0 = time.perf_counter()
+        out = fn()
+        self.times.setdefault(name, []).append(time.perf_counter() - t0)
+        return out
+
+    def report(self):
+        return {name: {**(percentiles(self.times[name]) if name in self.times else {'n': 0}), 'peak_kib': peak}
+                for name, peak in self.peak.items()}
+
+
+def cold_start(client, guard=None):
+    store = storage.SQLiteMirror(':memory:', storage.SheetsBackend(client, 'bench', guard))
+    store.sync()
+    if store.last_error is not None: raise store.last_error
+    return store
+
+def bench(tables, repeat=5, cart_size=5, today=None, quota_errors=0.0, seed=1):
+    today = today or datetime.now()
+    stages = Stages()
+    client = FakeClient(tables, storage.quota_faults(quota_errors, seed) if quota_errors else None)
+    # ไม่จำกัดงบคำขอ และไม่รอ backoff จริง (จดเวลาที่ต้องรอไว้แทน) ตัวเลขเวลาจะได้เทียบกับรอบที่ไม่มี error ได้
+    waits = []
+    guard = storage.QuotaGuard(per_minute=1e9, sleep=waits.append)
+    for _ in range(repeat):
+        # ดึงทั้งไฟล์ลงสำเนาในเครื่องใหม่ทุกรอบ (= เปิดแอปครั้งแรก)
+        store = stages.run('pull', lambda: cold_start(client, guard))
+    hist = [t for t in tables if t.startswith(storage.HISTORY_PREFIX)]
+    store.ensure(hist)
+    wards = [r[0] for r in tables['Locations'][1:]]
+    for _ in range(repeat):
+        frames = stages.run('read', lambda: {t: store.read(t) for t in storage.TABS})
+        drugs, (raw, keys) = frames['Drugs'][0], frames['Stock']
+        stock = stages.run('enrich', lambda: inventory.compact(inventory.enrich_stock(raw, inventory.drug_lookup(drugs))).assign(
+            Days_Left=lambda d: inventory.days_left(d['Expiry_Date'], today)))
+        index = stages.run('alert_index', lambda: inventory.ExpiryIndex(stock))
+        stages.run('alerts', lambda: (index.expiring(wards, 'ready', today, 7), index.expiring(wards, 'frozen', today, 3)))
+        lots = stages.run('stock_index', lambda: inventory.StockIndex(stock))
+        stages.run('options', lambda: [(lots.drugs(w), lots.batches(w), lots.expired(w, today)) for w in wards])
+        rates = stages.run('rates', lambda: redistribute.consumption_rates(store.dispensed_by_produced((today - timedelta(days=90)).date(), today.date()), 90))
+        stages.run('redistribute', lambda: redistribute.recommend(stock, rates, today, unit_cost=stock['Unit_Cost']))
+        stages.run('chart', lambda: inventory.stock_totals(stock, CHART_TOP_N).to_dict('records'))
+        # ตะกร้า: ยาที่มีในตู้ cart_size รายการ รายการละ 3 หน่วย
+        live = stock.drop_duplicates(['Location', 'Drug_Name']).head(cart_size)
+        cart = [{'Location': r.Location, 'Drug_Name': r.Drug_Name, 'Qty': 3} for r in live.itertuples()]
+        new_stock, _ = stages.run('fefo', lambda: stock_ops.allocate_fefo(stock, cart, 'bench'))
+
+        def save():
+            df_safe, archive = storage.split_history(storage.to_sheet_frame(new_stock, 'Stock'))
+            return store.save('Stock', df_safe, storage.to_sheet_frame(stock, 'Stock'), keys, archive)
+        stages.run('save', save, rerun=False)
+        stages.run('rollup', lambda: store.rollup('2000-01-01', today.date().isoformat(), wards))
+        stages.run('push', store.push, rerun=False)
+    quota = {'error_rate': quota_errors, 'retries': len(waits), 'backoff_s': sum(waits), 'breaker': guard.state()}
+    return stages.report(), client.book.calls, quota
+
+# หน้า login ต้องขึ้นภายในงบนี้ (import dashboard + รันสคริปต์รอบแรกกับชีตปลอม ไม่นับเวลา import streamlit เอง)
+LOGIN_BUDGET_MS = 1500
+HEAVY_MODULES = ['altair', 'gspread', 'google.oauth2', 'requests']
+_STARTUP = '''
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+t = time.perf_counter()
+at = AppTest.from_file("dashboard.py", default_timeout=60).run()
+ms = (time.perf_counter() - t) * 1000
+print(json.dumps({"login_ms": ms, "errors": [e.value for e in at.exception],
+                  "heavy_loaded": [m for m in sys.argv[1:] if m in sys.modules]}))
+'''
+
+def startup(tables, budget_ms=LOGIN_BUDGET_MS):
+    # เปิดแอปครั้งแรกใน process ใหม่ (import ทุกอย่างจากศูนย์ เหมือนเซิร์ฟเวอร์เพิ่งเริ่ม) จนหน้า login วาดเสร็จ
+    # heavy_loaded = โมดูลหนักที่ไม่ควรถูก import ก่อนต้องใช้จริง (กราฟ / ต่อ Google)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sheet.json')
+        with open(path, 'w', encoding='utf-8') as f: json.dump(tables, f, ensure_ascii=False)
+        env = {**os.environ, 'SSW_FAKE_SHEET': path, 'SSW_SYNC_INTERVAL': '3600'}
+        out = subprocess.run([sys.executable, '-c', _STARTUP, *HEAVY_MODULES], env=env, capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    return {**result, 'budget_ms': budget_ms, 'within_budget': result['login_ms'] <= budget_ms and not result['errors']}
+
+def chart_payload(tables, top_n=CHART_TOP_N):
+    # ข้อมูลกราฟภาพรวมที่ฝังไปกับ spec ส่งให้เบราว์เซอร์ทุกครั้ง (KiB ของ JSON)
+    #   เดิม: ยอดรวมทุก (ยา, หน่วยงาน) โตตามจำนวนยา × หน่วยงาน  ใหม่: top-N ยา + แท่งอื่นๆ
+    stock = inventory.enrich_stock(storage.frame_from_values(tables['Stock']), inventory.drug_lookup(storage.frame_from_values(tables['Drugs'])))
+    live = stock[stock['Record_Status'] == 'In_Stock']
+    kib = lambda df: len(json.dumps(df.to_dict('records'), ensure_ascii=False, default=float).encode()) / 1024
+    before = live.groupby(['Drug_Name', 'Location'])['Qty'].sum().reset_index()
+    after = inventory.stock_totals(stock, top_n)
+    return {'top_n': top_n, 'before_rows': len(before), 'before_kib': kib(before), 'after_rows': len(after), 'after_kib': kib(after)}
+
+def memory(tables, wards=1):
+    # หน่วยความจำ (KiB, นับข้อความจริงด้วย deep=True) ของตารางสต็อกที่แต่ละ session ถือไว้
+    #   เดิม: cache_data copy ตารางดิบ + ตารางที่เตรียมแล้วให้ทุก session + สำเนา filtered ตามหน่วยงานที่เลือก
+    #   ใหม่: ตารางดิบ/ตาราง compact ชุดเดียวแชร์ทั้งเครื่อง แต่ละ session ถือแค่ mask หน่วยงาน
+    raw = storage.frame_from_values(tables['Stock'])
+    plain = inventory.enrich_stock(raw, inventory.drug_lookup(storage.frame_from_values(tables['Drugs'])))
+    shared = inventory.compact(plain)
+    in_wards = plain['Location'].isin([r[0] for r in tables['Locations'][1:wards + 1]])
+    kib = lambda df: df.memory_usage(deep=True).sum() / 1024
+    return {'raw_kib': kib(raw), 'enriched_kib': kib(plain), 'compact_kib': kib(shared),
+            'per_session_before_kib': kib(raw) + kib(plain) + kib(plain[in_wards]),
+            'per_session_after_kib': in_wards.memory_usage(deep=True) / 1024}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="วัดความเร็วเส้นทางข้อมูลของ Smart Extemp Inventory กับชีตปลอมในหน่วยความจำ")
+    ap.add_argument('--wards', type=int, default=8)
+    ap.add_argument('--drugs', type=int, default=60)
+    ap.add_argument('--batches', type=int, default=5000, help="จำนวนล็อตในแท็บ Stock")
+    ap.add_argument('--history-months', type=int, default=6)
+    ap.add_argument('--history-rows', type=int, default=None, help="แถวต่อเดือนในแท็บประวัติ (ค่าเริ่มต้น = --batches)")
+    ap.add_argument('--frozen-ratio', type=float, default=0.3)
+    ap.add_argument('--repeat', type=int, default=5)
+    ap.add_argument('--cart', type=int, default=5, help="จำนวนรายการในตะกร้าจ่ายยาแต่ละรอบ")
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--quota-errors', type=float, default=0.0, help="สัดส่วนคำขอที่ชีตปลอมตอบ 429 โควตาเต็ม (0-1)")
+    ap.add_argument('--login-budget', type=float, default=LOGIN_BUDGET_MS, help="งบเวลาเปิดหน้า login ครั้งแรก (ms)")
+    ap.add_argument('--skip-startup', action='store_true', help="ไม่วัดเวลาเปิดหน้า login (ต้องมี streamlit)")
+    ap.add_argument('--out', default='-', help="ไฟล์ JSON ผลลัพธ์ (- = stdout)")
+    args = ap.parse_args(argv)
+
+    today = datetime.now()
+    tables = generate(args.wards, args.drugs, args.batches, args.history_months, args.history_rows, args.frozen_ratio, args.seed, today)
+    stages, calls, quota = bench(tables, args.repeat, args.cart, today, args.quota_errors, args.seed)
+    result = {
+        'params': {k: v for k, v in vars(args).items() if k != 'out'},
+        'rows': {t: len(v) - 1 for t, v in tables.items()},
+        'env': {'python': platform.python_version(), 'pandas': pd.__version__, 'platform': platform.platform()},
+        'stages': stages,
+        'sheet_calls': len(calls),
+        'quota': quota,
+        'memory': memory(tables),
+        'chart_payload': chart_payload(tables),
+    }
+    if not args.skip_startup: result['startup'] = startup(tables, args.login_budget)
+    text = json.dumps(result, indent=2, sort_keys=True, default=float)
+    if args.out == '-': print(text)
+    else:
+        with open(args.out, 'w', encoding='utf-8') as f: f.write(text + '\n')
+        print(f"บันทึกผลไว้ที่ {args.out}", file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+# 🧮 ขั้นตอนเตรียมข้อมูลสต็อก (pandas ล้วน ไม่มี streamlit) ให้แอปเรียกผ่าน cache ตามเวอร์ชันข้อมูล
+import numpy as np
+import pandas as pd
+
+def merge_key(names):
+    # ชื่อยาแบบไม่สนช่องว่าง/ตัวพิมพ์ ใช้จับคู่ Stock กับ Drugs
+    return names.astype(str).str.replace(r'\s+', '', regex=True).str.lower()
+
+def drug_lookup(drugs):
+    # ตารางค้นหา ชื่อยา(normalized) -> Unit_Cost / Type / BUD_Cold คำนวณครั้งเดียวต่อเวอร์ชันของ Drugs
+    if drugs.empty: return pd.DataFrame(columns=['Unit_Cost', 'Type', 'BUD_Cold'])
+    u_cost_col = next((c for c in drugs.columns if 'cost' in str(c).lower() or 'ราคา' in str(c)), None)
+    type_col = next((c for c in drugs.columns if 'type' in str(c).lower() or 'ประเภท' in str(c)), None)
+    bud_col = next((c for c in drugs.columns if 'cold' in str(c).lower()), None)
+
+    lookup = pd.DataFrame(index=merge_key(drugs['Drug_Name']))
+    if u_cost_col:
+        cost = drugs[u_cost_col].astype(str).str.replace(r'[^\d.]', '', regex=True)
+        lookup['Unit_Cost'] = pd.to_numeric(cost, errors='coerce').fillna(0).values
+    if type_col: lookup['Type'] = drugs[type_col].values
+    if bud_col: lookup['BUD_Cold'] = drugs[bud_col].values
+    # ชื่อยาซ้ำใน Drugs ให้ใช้แถวแรก (ไม่งั้นตอน merge แถวสต็อกจะถูกคูณซ้ำ)
+    return lookup[~lookup.index.duplicated()]
+
+def enrich_stock(stock, lookup):
+    # แปลงชนิดข้อมูล + เติมราคา/ประเภทจากฐานข้อมูลยา (ยังไม่คิด Days_Left เพราะขึ้นกับวันที่ปัจจุบัน)
+    stock = stock.copy()
+    # 💡 สร้างระบบเก็บประวัติการทำงาน (Record Status) 💡
+    if 'Record_Status' not in stock.columns:
+        stock['Record_Status'] = 'In_Stock'
+        # แก้ไขข้อมูลเก่าให้เข้ากับระบบใหม่
+        stock.loc[stock['Location'] == 'Disposal', 'Record_Status'] = 'Disposed'
+
+    for c in ['Date_Produced', 'Expiry_Date']:
+        if c not in stock.columns: stock[c] = ''
+
+    stock['Qty'] = pd.to_numeric(stock['Qty'], errors='coerce').fillna(0)
+    stock['Date_Produced'] = pd.to_datetime(stock['Date_Produced'], errors='coerce')
+    stock['Expiry_Date'] = pd.to_datetime(stock['Expiry_Date'], errors='coerce')
+
+    if 'Status' not in stock.columns: stock['Status'] = 'Active'
+    if 'Action_By' not in stock.columns: stock['Action_By'] = '-'
+
+    if len(lookup.columns):
+        # จับคู่ชื่อยาเฉพาะชื่อที่ไม่ซ้ำกัน แล้วค่อยกระจายกลับ (เร็วกว่า regex ทั้งคอลัมน์ + merge)
+        names = stock['Drug_Name'].astype(str)
+        uniq = pd.Index(names.unique())
+        matched = lookup.reindex(merge_key(pd.Series(uniq))).set_axis(uniq)
+        for col in lookup.columns:
+            stock[col] = names.map(matched[col]).values
+
+    if 'Unit_Cost' not in stock.columns: stock['Unit_Cost'] = 0
+    if 'Type' not in stock.columns: stock['Type'] = 'Room'
+    stock['Unit_Cost'] = pd.to_numeric(stock['Unit_Cost'], errors='coerce').fillna(0)
+    stock['Total_Value'] = stock['Qty'] * stock['Unit_Cost']
+    return stock
+
+# คอลัมน์ข้อความที่ค่าซ้ำกันเยอะ (หน่วยงาน/ชื่อยา/สถานะ/ผู้ทำรายการ) เก็บเป็น category ประหยัดหน่วยความจำหลายเท่า
+CATEGORY_COLS = ['Location', 'Drug_Name', 'Status', 'Record_Status', 'Type', 'Action_By']
+
+def compact(stock):
+    # ตารางสต็อกแบบประหยัดหน่วยความจำ สำหรับแชร์อ่านอย่างเดียวทุก session
+    # category สำหรับข้อความซ้ำๆ, Qty เป็น int32 ถ้าเป็นจำนวนเต็มทั้งหมด (วันที่เป็น datetime64 จาก enrich_stock อยู่แล้ว)
+    stock = stock.astype({c: 'category' for c in CATEGORY_COLS if c in stock.columns})
+    q = stock['Qty']
+    if len(q) and (q % 1 == 0).all() and q.abs().max() < 2 ** 31: stock['Qty'] = q.astype('int32')
+    return stock
+
+def editable(stock):
+    # สำเนาที่แก้ไข/เพิ่มแถวได้อิสระ (category -> object, Qty -> float) ใช้ก่อนแก้ตารางที่ได้จาก compact
+    cats = {c: object for c in stock.columns if isinstance(stock[c].dtype, pd.CategoricalDtype)}
+    if 'Qty' in stock.columns: cats['Qty'] = 'float64'
+    return stock.astype(cats)
+
+def days_left(expiry, today):
+    return (expiry - pd.Timestamp(today.date())).dt.days
+
+class ExpiryIndex:
+    # ดัชนีวันหมดอายุของล็อตที่ยังอยู่ในตู้ แยกถังตาม (หน่วยงาน, กลุ่ม) และเรียงตาม Expiry_Date ไว้แล้ว
+    #   'frozen' = ยาแช่แข็งที่ยังไม่ละลาย, 'ready' = ยาที่พร้อมใช้ (รวมที่ละลายแล้ว)
+    # สร้างครั้งเดียวต่อเวอร์ชันข้อมูล แล้วใช้ร่วมกันทุก session (ห้ามแก้ค่าข้างใน)
+    COLS = ['Drug_Name', 'Batch_ID', 'Location', 'Qty', 'Expiry_Date']
+
+    def __init__(self, stock):
+        self.buckets = {}
+        if stock.empty: return
+        # ล็อตที่ไม่มีวันหมดอายุ (NaT) ถูกเรียงไว้ท้ายถัง -> ไม่ติดแจ้งเตือน แต่ยังเลือกละลายได้
+        live = stock[stock['Record_Status'] == 'In_Stock']
+        frozen = (live['Type'] == 'Frozen') & (live['Status'] == 'Frozen')
+        cols = [c for c in self.COLS if c in live.columns]
+        live = live[cols].assign(_group=frozen.map({True: 'frozen', False: 'ready'}))
+        for key, g in live.sort_values('Expiry_Date', kind='stable').groupby(['Location', '_group'], sort=False, observed=True):
+            g = g.drop(columns='_group').reset_index(drop=True)
+            self.buckets[key] = (g['Expiry_Date'].values, g)
+
+    def upto(self, wards, group, until=None):
+        # ล็อตของหน่วยงานที่เลือกที่หมดอายุก่อน until (None = ทั้งหมด) เรียงตามวันหมดอายุ
+        parts = []
+        for ward in wards:
+            if (ward, group) not in self.buckets: continue
+            expiry, g = self.buckets[(ward, group)]
+            n = len(g) if until is None else expiry.searchsorted(pd.Timestamp(until).to_datetime64(), side='left')
+            if n: parts.append(g.iloc[:n])
+        if not parts: return pd.DataFrame(columns=self.COLS).astype({'Expiry_Date': 'datetime64[ns]'})
+        return pd.concat(parts, ignore_index=True).sort_values('Expiry_Date', kind='stable')
+
+    def expiring(self, wards, group, today, days):
+        # Days_Left <= days  <=>  Expiry_Date < วันนี้ + (days + 1) วัน
+        found = self.upto(wards, group, pd.Timestamp(today.date()) + pd.Timedelta(days=days + 1))
+        return found.assign(Days_Left=days_left(found['Expiry_Date'], today))
+
+class StockIndex:
+    # ดัชนีล็อตที่ยังอยู่ในตู้ สำหรับตัวเลือกในการ์ดจ่าย/โอน/ทิ้ง/ละลาย สร้างครั้งเดียวต่อเวอร์ชันข้อมูล แชร์ทุก session (ห้ามแก้ค่าข้างใน)
+    #   key ของล็อต = (หน่วยงาน, Batch_ID) ใช้เป็นค่าของ selectbox ตรงๆ ไม่ต้องแกะข้อความกลับ
+    #   row[key] = index ของแถวในตารางสต็อก, lots[key] = (ชื่อยา, จำนวน)
+    #   หน่วยงาน -> ยา -> ล็อต (เฉพาะที่มีของ) เรียงตามวันหมดอายุ ล็อตไม่มีวันหมดอายุอยู่ท้าย
+    def __init__(self, stock):
+        self.row, self.lots, self.totals = {}, {}, {}
+        self.ward_lots, self.drug_lots, self.expiry = {}, {}, {}
+        if stock.empty: return
+        live = stock[stock['Record_Status'] == 'In_Stock'].sort_values('Expiry_Date', kind='stable', na_position='last')
+        for i, ward, drug, batch, qty, exp in zip(live.index, live['Location'], live['Drug_Name'], live['Batch_ID'], live['Qty'], live['Expiry_Date'].values):
+            if qty > 0:
+                totals = self.totals.setdefault(ward, {})
+                totals[drug] = totals.get(drug, 0) + qty
+            key = (ward, batch)
+            if key in self.row: continue  # Batch ซ้ำในหน่วยงานเดียวกัน -> ใช้ล็อตที่หมดอายุก่อน
+            self.row[key], self.lots[key] = i, (drug, qty)
+            if qty > 0:
+                self.ward_lots.setdefault(ward, []).append(key)
+                self.drug_lots.setdefault((ward, drug), []).append(key)
+                self.expiry.setdefault(ward, []).append(exp)
+        self.totals = {w: dict(sorted(t.items())) for w, t in self.totals.items()}
+        self.expiry = {w: np.array(e, dtype='datetime64[ns]') for w, e in self.expiry.items()}
+
+    def drugs(self, ward):
+        # {ชื่อยา: จำนวนรวม} ของยาที่มีในหน่วยงาน เรียงตามชื่อ
+        return self.totals.get(ward, {})
+
+    def batches(self, ward, drug=None):
+        return self.ward_lots.get(ward, []) if drug is None else self.drug_lots.get((ward, drug), [])
+
+    def expired(self, ward, today):
+        # ล็อตที่ Days_Left < 0 (หมดอายุก่อนวันนี้) = ช่วงต้นของรายการที่เรียงตามวันหมดอายุ
+        if ward not in self.expiry: return []
+        return self.ward_lots[ward][:self.expiry[ward].searchsorted(pd.Timestamp(today.date()).to_datetime64(), side='left')]
+
+    def label(self, key):
+        drug, qty = self.lots[key]
+        return f"{drug} ({key[1]}) [เหลือ {int(qty)}]"
+
+# 📊 กราฟภาพรวมสต็อก: รวมยอดก่อนส่งไปหน้าเว็บ (ข้อมูลในกราฟถูกฝังไปกับ spec ทุกครั้ง -> ต้องเล็กเสมอ ไม่ว่าสต็อกจะมีกี่ล็อต)
+OTHER = "อื่นๆ"
+
+def stock_totals(stock, top_n=20, by='Location'):
+    # ยอดคงเหลือ In_Stock รวมตาม (ยา, by) เฉพาะ top_n ยาที่ยอดรวมมากสุด ที่เหลือรวมเป็นแท่งเดียว "อื่นๆ (k รายการ)"
+    # เรียงตามยอดรวมของยา (มาก -> น้อย) แท่งอื่นๆ อยู่ท้ายสุด -> แถวไม่เกิน (top_n + 1) × จำนวนค่าของ by
+    live = stock[stock['Record_Status'] == 'In_Stock']
+    agg = live.groupby(['Drug_Name', by], observed=True)['Qty'].sum().reset_index()
+    agg = agg[agg['Qty'] != 0].astype({'Drug_Name': str, by: str})
+    totals = agg.groupby('Drug_Name')['Qty'].sum().sort_values(ascending=False, kind='stable')
+    rank = pd.Series(range(len(totals)), index=totals.index)
+    rest = totals.index[top_n:]
+    if len(rest):
+        rank = rank[:top_n]
+        agg.loc[agg['Drug_Name'].isin(rest), 'Drug_Name'] = other = f"{OTHER} ({len(rest)} รายการ)"
+        rank[other] = top_n
+        agg = agg.groupby(['Drug_Name', by], sort=False)['Qty'].sum().reset_index()
+    agg['Qty'] = agg['Qty'].astype(float)
+    return agg.assign(_rank=agg['Drug_Name'].map(rank)).sort_values(['_rank', 'Qty'], ascending=[True, False], kind='stable') \
+              .drop(columns='_rank').reset_index(drop=True)
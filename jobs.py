@@ -0,0 +1,92 @@
+# 🌙 งานเบื้องหลังแบบไม่ต้องเปิดหน้าเว็บ (ตั้งเวลารันจาก cron / Task Scheduler ได้)
+#   python jobs.py sweep               ทิ้งยาหมดอายุ (In_Stock ที่เลยวันหมดอายุ) ทุกหน่วยงาน บันทึกครั้งเดียว แล้วส่งขึ้นชีต
+#   python jobs.py sweep --dry-run     ดูสรุปอย่างเดียว ไม่บันทึก
+#   python jobs.py sweep --wards ER,ICU --json
+# ตัวอย่าง crontab (ตีหนึ่งทุกวัน):  0 1 * * * cd /srv/ssw && python jobs.py sweep >> .ssw_cache/sweep.log 2>&1
+#
+# กุญแจ Google: service_account.json ในโฟลเดอร์นี้ / ตัวแปร GOOGLE_CREDENTIALS (JSON) / .streamlit/secrets.toml แบบเดียวกับแอป
+# ใช้สำเนาในเครื่องแยกจากแอป (SSW_JOBS_DB) -> ถ้าส่งขึ้นชีตไม่สำเร็จ รายการจะค้างคิวไว้ส่งในรอบถัดไป
+# ทดสอบกับชีตปลอม: SSW_FAKE_SHEET=ไฟล์.json python jobs.py sweep
+import argparse
+import json
+import os
+import sys
+import tomllib
+from datetime import datetime
+
+import gspread
+from google.oauth2.service_account import Credentials
+
+import inventory
+import stock_ops
+import storage
+
+USER_NAME = "งานกวาดยาหมดอายุ"
+JOBS_DB = os.environ.get("SSW_JOBS_DB", os.path.join(".ssw_cache", "jobs.db"))
+SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
+
+
+# --- 1. เชื่อมต่อ ---
+def load_credentials():
+    if os.path.exists("service_account.json"): return Credentials.from_service_account_file("service_account.json", scopes=SCOPES)
+    creds_str = os.environ.get("GOOGLE_CREDENTIALS")
+    if not creds_str and os.path.exists(os.path.join(".streamlit", "secrets.toml")):
+        with open(os.path.join(".streamlit", "secrets.toml"), 'rb') as f: secrets = tomllib.load(f)
+        creds_str = secrets.get("GOOGLE_CREDENTIALS") or secrets.get("google_credentials")
+    if not creds_str: raise LookupError("ไม่พบกุญแจ Google (service_account.json / GOOGLE_CREDENTIALS / .streamlit/secrets.toml)")
+    return Credentials.from_service_account_info(json.loads(creds_str), scopes=SCOPES)
+
+def open_store(fake_path=None, mirror_path=JOBS_DB):
+    if fake_path: return storage.SQLiteMirror(":memory:", storage.MemoryBackend.from_json(fake_path))
+    return storage.SQLiteMirror(mirror_path, storage.SheetsBackend(gspread.authorize(load_credentials()), storage.SHEET_ID))
+
+
+# --- 2. งาน ---
+def sweep(store, today, locations=None, dry_run=False):
+    # ทิ้งยาหมดอายุทุกล็อตในการบันทึกครั้งเดียว (แถวที่ทิ้งย้ายไปแท็บประวัติตามปกติของ save_frame)
+    raw, keys = store.read('Stock')
+    drugs, _ = store.read('Drugs')
+    if raw.empty: return {'date': today.strftime('%Y-%m-%d'), 'lots': 0, 'qty': 0.0, 'value': 0.0, 'items': [], 'saved': False}
+    stock = inventory.enrich_stock(raw, inventory.drug_lookup(drugs))
+    new_stock, summary = stock_ops.sweep_expired(stock, today, USER_NAME, locations)
+    saved = bool(len(summary)) and not dry_run
+    if saved: store.save_frame('Stock', new_stock, raw, keys)
+    return {'date': today.strftime('%Y-%m-%d'), 'lots': int(summary['Lots'].sum()), 'qty': float(summary['Qty'].sum()),
+            'value': float(summary['Value'].sum()), 'items': summary.to_dict('records'), 'saved': saved}
+
+def format_report(report):
+    lines = [f"🧹 กวาดยาหมดอายุ ณ {report['date']}: {report['lots']} ล็อต รวม {report['qty']:g} หน่วย มูลค่า ฿{report['value']:,.2f}"
+             + ("" if report['saved'] or not report['lots'] else " (ยังไม่บันทึก)")]
+    for r in report['items']:
+        lines.append(f"  - {r['Location']}: {r['Drug_Name']} {r['Lots']} ล็อต {r['Qty']:g} หน่วย ฿{r['Value']:,.2f}")
+    if report.get('pending'): lines.append(f"⚠️ ส่งขึ้น Google Sheets ไม่สำเร็จ ค้างคิว {report['pending']} รายการ (จะส่งในรอบถัดไป)")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="งานเบื้องหลังของ Smart Extemp Inventory (ไม่ต้องเปิดหน้าเว็บ)")
+    sub = ap.add_subparsers(dest='command', required=True)
+    sw = sub.add_parser('sweep', help="ทิ้งยาหมดอายุทุกหน่วยงานในการบันทึกครั้งเดียว")
+    sw.add_argument('--wards', default=None, help="เฉพาะหน่วยงาน คั่นด้วย , (ค่าเริ่มต้น = ทุกหน่วยงาน)")
+    sw.add_argument('--today', default=None, help="วันที่อ้างอิง YYYY-MM-DD (ค่าเริ่มต้น = วันนี้)")
+    sw.add_argument('--dry-run', action='store_true', help="สรุปอย่างเดียว ไม่บันทึก")
+    sw.add_argument('--json', action='store_true', help="พิมพ์ผลเป็น JSON")
+    args = ap.parse_args(argv)
+
+    store = open_store(os.environ.get("SSW_FAKE_SHEET"))
+    # ต้องได้ข้อมูลล่าสุดจากชีตก่อน (ส่งคิวที่ค้างจากรอบก่อนด้วย) ไม่งั้นอาจทิ้งยาจากสำเนาเก่า
+    store.sync()
+    if store.last_error is not None:
+        print(f"❌ เชื่อมต่อ Google Sheets ไม่ได้ ยกเลิกรอบนี้: {store.last_error}", file=sys.stderr)
+        return 2
+    today = datetime.strptime(args.today, '%Y-%m-%d') if args.today else datetime.now()
+    report = sweep(store, today, args.wards.split(',') if args.wards else None, args.dry_run)
+    if report['saved']:
+        try: store.push()
+        except Exception as e: print(f"⚠️ ส่งขึ้นชีตไม่สำเร็จ: {e}", file=sys.stderr)
+    report['pending'] = store.pending()
+    print(json.dumps(report, ensure_ascii=False, indent=2, default=float) if args.json else format_report(report))
+    return 1 if report['pending'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
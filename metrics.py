@@ -0,0 +1,101 @@
+# ⏱️ จับเวลาแต่ละช่วงของการรันหน้าเว็บ + นับคำขอ Google Sheets (ไม่มี streamlit ใช้ได้ทั้งแอปและ thread เบื้องหลัง)
+# - ปิดอยู่ (ค่าเริ่มต้น) timer/count จะคืนทันที แทบไม่มีต้นทุน -> เปิดด้วย SSW_METRICS=1 หรือสวิตช์ในแถบข้างของแอดมิน
+# - ส่งออกได้ทั้ง JSON lines (หนึ่งบรรทัดต่อการรันหนึ่งรอบ) และไฟล์ข้อความแบบ Prometheus
+#   ตั้ง SSW_METRICS_JSONL / SSW_METRICS_PROM = path เพื่อให้เขียนไฟล์เองทุกครั้งที่รันจบ
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+_NOOP = contextlib.nullcontext()
+
+
+class Recorder:
+    def __init__(self, enabled=False, keep=20, jsonl_path=None, prom_path=None):
+        self.enabled = enabled
+        self.runs = deque(maxlen=keep)  # การรันที่จบแล้ว ล่าสุดอยู่ท้าย
+        self.jsonl_path = jsonl_path
+        self.prom_path = prom_path
+        self.lock = threading.Lock()
+        self.phase_totals = {}  # ชื่อช่วง -> [จำนวนครั้ง, เวลารวม(วินาที)] ตั้งแต่เปิดเครื่อง
+        self.counters = {}
+        self._local = threading.local()
+
+    # ---------- การรันหนึ่งรอบ (ต่อ thread ของ session) ----------
+    def start_run(self, label=''):
+        if not self.enabled: return
+        self._finish(interrupted=True)  # รอบก่อนโดน st.rerun/st.stop ตัดกลางทาง
+        self._local.run = {'ts': time.time(), 'label': label, 't0': time.perf_counter(), 'phases': {}, 'counts': {}}
+
+    def end_run(self):
+        if self.enabled: self._finish()
+
+    def active(self):
+        # thread นี้กำลังอยู่ในการรันที่เปิดไว้ (ใช้แยกการ rerun เฉพาะ fragment ออกจากการรันเต็มหน้า)
+        return getattr(self._local, 'run', None) is not None
+
+    def _finish(self, interrupted=False):
+        run = getattr(self._local, 'run', None)
+        if run is None: return
+        self._local.run = None
+        run['total_ms'] = (time.perf_counter() - run.pop('t0')) * 1000
+        run['interrupted'] = interrupted
+        with self.lock: self.runs.append(run)
+        if self.jsonl_path:
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f: f.write(json.dumps(run, ensure_ascii=False) + '\n')
+        if self.prom_path:
+            with open(self.prom_path + '.tmp', 'w', encoding='utf-8') as f: f.write(self.prometheus())
+            os.replace(self.prom_path + '.tmp', self.prom_path)
+
+    # ---------- จับเวลา / นับ ----------
+    def timer(self, phase):
+        return self._timer(phase) if self.enabled else _NOOP
+
+    @contextlib.contextmanager
+    def _timer(self, phase):
+        t0 = time.perf_counter()
+        try: yield
+        finally: self._add_phase(phase, time.perf_counter() - t0)
+
+    def _add_phase(self, phase, seconds):
+        with self.lock:
+            tot = self.phase_totals.setdefault(phase, [0, 0.0])
+            tot[0] += 1; tot[1] += seconds
+        run = getattr(self._local, 'run', None)
+        if run is not None: run['phases'][phase] = run['phases'].get(phase, 0) + seconds * 1000
+
+    def count(self, name, n=1):
+        if not self.enabled: return
+        with self.lock: self.counters[name] = self.counters.get(name, 0) + n
+        run = getattr(self._local, 'run', None)
+        if run is not None: run['counts'][name] = run['counts'].get(name, 0) + n
+
+    def payload(self, name, values):
+        # ขนาดข้อมูลที่รับ/ส่งกับชีต (ไบต์ของ JSON) คิดเฉพาะตอนเปิดอยู่ เพราะต้อง serialize ทั้งก้อน
+        if self.enabled: self.count(name + '_bytes', len(json.dumps(values, ensure_ascii=False).encode()))
+
+    # ---------- ส่งออก ----------
+    def recent(self):
+        with self.lock: return list(self.runs)
+
+    def jsonl(self):
+        return ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in self.recent())
+
+    def prometheus(self):
+        def label(v): return str(v).replace('\\', '\\\\').replace('"', '\\"')
+        with self.lock:
+            phases, counters = dict(self.phase_totals), dict(self.counters)
+        lines = ["# HELP ssw_phase_seconds Time spent per app phase.", "# TYPE ssw_phase_seconds summary"]
+        for phase, (n, total) in sorted(phases.items()):
+            lines.append(f'ssw_phase_seconds_count{{phase="{label(phase)}"}} {n}')
+            lines.append(f'ssw_phase_seconds_sum{{phase="{label(phase)}"}} {total:.6f}')
+        lines += ["# HELP ssw_events_total Counted events (Sheets calls, payload bytes).", "# TYPE ssw_events_total counter"]
+        lines += [f'ssw_events_total{{name="{label(k)}"}} {v}' for k, v in sorted(counters.items())]
+        return '\n'.join(lines) + '\n'
+
+
+recorder = Recorder(enabled=os.environ.get("SSW_METRICS", "0") == "1",
+                    jsonl_path=os.environ.get("SSW_METRICS_JSONL"), prom_path=os.environ.get("SSW_METRICS_PROM"))
+timer, count, payload = recorder.timer, recorder.count, recorder.payload
@@ -0,0 +1,79 @@
+# ♻️ แนะนำการโอนยาใกล้หมดอายุไปหน่วยงานที่น่าจะใช้หมดทัน (pandas ล้วน ไม่มี streamlit)
+# - อัตราการใช้ยาต่อวันของแต่ละ (หน่วยงาน, ยา) ประมาณจากยอด Dispensed ของล็อตที่ผลิตในช่วงย้อนหลัง (SQLiteMirror.dispensed_by_produced
+#   อ่านจากตารางสรุปรายวันที่อัปเดตทีละส่วนทุกครั้งที่บันทึก/ดึงชีต -> ไม่ต้องไล่ประวัติทุกแถวใหม่)
+#   ชีตไม่มีวันที่จ่ายจริง จึงเป็นยอดจ่ายต่อวันผลิต ไม่ใช่ยอดจ่ายต่อวันปฏิทิน (ดูหมายเหตุที่ dispensed_by_produced)
+# - จำลองการใช้ยาแบบ FEFO ต่อ (หน่วยงาน, ยา): ล็อตไหนใช้ไม่ทันก่อนหมดอายุ = ยาที่จะต้องทิ้ง (waste)
+# - จับคู่ทุกล็อตกับทุกหน่วยงานพร้อมกัน: ไล่ล็อตที่หมดอายุก่อน ให้หน่วยงานที่ยังรับไหวมากที่สุดก่อน
+#   รับไหว = ใช้ทันก่อนล็อตนี้หมดอายุ และไม่ดันล็อตเดิมของหน่วยงานนั้นให้กลายเป็นยาทิ้งแทน (หักยอดที่แนะนำไปแล้วด้วย)
+import numpy as np
+import pandas as pd
+
+KEYS = ['Location', 'Drug_Name']
+COLS = ['Row', 'Batch_ID', 'Drug_Name', 'From', 'To', 'Qty', 'Days_Left', 'Waste', 'Rate_To', 'Days_To_Use', 'Value']
+
+
+def consumption_rates(dispensed, days):
+    # dispensed = ตาราง Location, Drug_Name, Qty (ยอดจ่ายรวมของช่วง days วัน) -> Series อัตราต่อวัน index (Location, Drug_Name)
+    rates = dispensed.groupby(KEYS)['Qty'].sum().astype(float) / max(days, 1)
+    return rates[rates > 0]
+
+def fefo_usage(stock, rates, today):
+    # ล็อตที่ยังอยู่ในตู้ (ไม่นับยาแช่แข็งที่ยังไม่ละลาย) + คาดการณ์ว่าจะใช้ได้เท่าไหร่ก่อนหมดอายุ
+    #   D = ความต้องการสะสมถึงวันหมดอายุของล็อต (อัตรา × วันที่เหลือ), Q = ยอดสะสมของล็อตเรียงตามวันหมดอายุ
+    #   ใช้ไปสะสม C_i = min(C_{i-1} + q_i, D_i) = Q_i + min(0, min_{j<=i}(D_j - Q_j)) -> คิดทั้งตารางได้ด้วย cummin
+    #   Spare = ความต้องการที่ยังเหลือก่อนล็อตนี้และทุกล็อตหลังจากนี้หมดอายุ (รับยาเพิ่มได้เท่านี้โดยไม่เกิดยาทิ้ง)
+    live = stock[(stock['Record_Status'] == 'In_Stock') & (stock['Qty'] > 0) & (stock['Status'] != 'Frozen')]
+    exp = pd.to_datetime(live['Expiry_Date'], errors='coerce')
+    lots = pd.DataFrame({'Location': live['Location'].astype(str), 'Drug_Name': live['Drug_Name'].astype(str),
+                         'Batch_ID': live['Batch_ID'], 'Qty': live['Qty'].astype(float),
+                         'Days_Left': (exp - pd.Timestamp(today).normalize()).dt.days}, index=live.index).dropna(subset=['Days_Left'])
+    lots = lots.sort_values(KEYS + ['Days_Left'], kind='stable')
+    rate = pd.Series(rates.reindex(pd.MultiIndex.from_frame(lots[KEYS])).fillna(0).values, index=lots.index)
+    g = lots.groupby(KEYS, sort=False)
+    d = rate * lots['Days_Left'].clip(lower=0)
+    q = g['Qty'].cumsum()
+    used = q + (d - q).groupby([lots['Location'], lots['Drug_Name']], sort=False).cummin().clip(upper=0)
+    lots['Used'] = used - used.groupby([lots['Location'], lots['Drug_Name']], sort=False).shift(fill_value=0)
+    lots['Waste'] = lots['Qty'] - lots['Used']
+    lots['Rate'], lots['Demand'], lots['Consumed'] = rate, d, used
+    # cummin จากท้ายกลุ่ม (groupby จับคู่ key ตาม index จึงกลับลำดับได้เลย)
+    lots['Spare'] = (d - used).iloc[::-1].groupby([lots['Location'], lots['Drug_Name']], sort=False).cummin()
+    return lots
+
+def recommend(stock, rates, today, horizon=30, min_days=1, sources=None, unit_cost=None):
+    # คืนตารางคำแนะนำ (COLS) เรียงตามมูลค่าที่ช่วยไม่ให้ต้องทิ้ง: ล็อตที่หมดอายุใน min_days..horizon วันและคาดว่าจะเหลือทิ้ง
+    # sources = โอนออกเฉพาะจากหน่วยงานเหล่านี้ (None = ทุกหน่วยงาน), unit_cost = Series ราคาต่อหน่วยตาม index ของ stock
+    lots = fefo_usage(stock, rates, today)
+    cand = lots[(lots['Waste'] >= 1) & lots['Days_Left'].between(min_days, horizon)]
+    if sources is not None: cand = cand[cand['Location'].isin(list(sources))]
+    if cand.empty or rates.empty: return pd.DataFrame(columns=COLS)
+
+    # ข้อมูลฝั่งผู้รับ ต่อ (หน่วยงาน, ยา): วันหมดอายุของล็อตเดิม / ใช้ไปสะสม / ความต้องการที่เหลือหลังจากนั้น
+    days, consumed, spare = (lots[c].to_numpy() for c in ['Days_Left', 'Consumed', 'Spare'])
+    own = {k: (days[pos], consumed[pos], spare[pos]) for k, pos in lots.groupby(KEYS, sort=False).indices.items()}
+    none = (days[:0], consumed[:0], spare[:0])
+    by_drug = {}
+    for (ward, drug), rate in rates.items(): by_drug.setdefault(drug, []).append((ward, rate))
+    cand = cand.sort_values('Days_Left', kind='stable')
+    cost = unit_cost.reindex(cand.index).fillna(0).to_numpy(dtype=float) if unit_cost is not None else np.zeros(len(cand))
+    assigned = {}
+    out = []
+    for lot, price in zip(cand.itertuples(), cost):
+        left = np.floor(lot.Waste)
+        offers = []
+        for ward, rate in by_drug.get(lot.Drug_Name, []):
+            if ward == lot.Location: continue
+            w_days, w_used, w_spare = own.get((ward, lot.Drug_Name), none)
+            k = np.searchsorted(w_days, lot.Days_Left, side='right')
+            cap = rate * lot.Days_Left - (w_used[k - 1] if k else 0.0)
+            if k < len(w_spare): cap = min(cap, w_spare[k])
+            cap = np.floor(cap - assigned.get((ward, lot.Drug_Name), 0))
+            if cap >= 1: offers.append((cap, rate, ward))
+        for cap, rate, ward in sorted(offers, reverse=True):
+            if left < 1: break
+            qty = min(left, cap)
+            left -= qty
+            assigned[(ward, lot.Drug_Name)] = assigned.get((ward, lot.Drug_Name), 0) + qty
+            out.append((lot.Index, lot.Batch_ID, lot.Drug_Name, lot.Location, ward, int(qty), int(lot.Days_Left), lot.Waste, rate, qty / rate, qty * price))
+    if not out: return pd.DataFrame(columns=COLS)
+    return pd.DataFrame(out, columns=COLS).sort_values(['Value', 'Days_Left', 'Qty'], ascending=[False, True, False], kind='stable').reset_index(drop=True)
@@ -0,0 +1,162 @@
+# ✂️ งานตัดสต็อก (pandas ล้วน ไม่มี streamlit) รับตารางสต็อก คืนตารางสต็อกใหม่ให้ผู้เรียกไปบันทึกเอง
+import re
+
+import pandas as pd
+
+import inventory
+
+def allocate_fefo(stock, cart, user_name):
+    # ตัดจ่ายแบบ FEFO หลายรายการในครั้งเดียว
+    # cart = ตาราง/ลิสต์ของ {'Location', 'Drug_Name', 'Qty'} -> คืน (สต็อกใหม่, สรุปต่อรายการ)
+    stock = inventory.editable(stock)  # ได้สำเนาของตัวเอง (ตารางจากแอปเป็นตารางกลางแบบ category ห้ามแก้ตรงๆ)
+    cart = pd.DataFrame(cart, columns=['Location', 'Drug_Name', 'Qty'])
+    want = cart.groupby(['Location', 'Drug_Name'], sort=False)['Qty'].sum().rename('Want')
+
+    # 1. ล็อตที่จ่ายได้ของทุกรายการในตะกร้า เรียงล็อตที่หมดอายุก่อนขึ้นก่อน (ไม่มีวันหมดอายุไว้ท้ายสุด)
+    live = stock[(stock['Record_Status'] == 'In_Stock') & (stock['Qty'] > 0)]
+    # (ใช้ reindex แทน join: join กับตารางว่างจะเปลี่ยน index เป็นของ want แล้วหาแถวเดิมไม่เจอ)
+    cand = live[['Location', 'Drug_Name', 'Qty', 'Expiry_Date']]
+    cand = cand.assign(Want=want.reindex(pd.MultiIndex.from_frame(cand[['Location', 'Drug_Name']])).values).dropna(subset=['Want'])
+    cand = cand.sort_values(['Location', 'Drug_Name', 'Expiry_Date'], na_position='last', kind='stable')
+
+    # 2. ยอดสะสมต่อ (หน่วยงาน, ยา): ล็อตไหนถูกตัดเท่าไหร่ = ส่วนที่ยังขาดก่อนถึงล็อตนี้ แต่ไม่เกินจำนวนในล็อต
+    before = cand.groupby(['Location', 'Drug_Name'], sort=False)['Qty'].cumsum() - cand['Qty']
+    take = (cand['Want'] - before).clip(lower=0).clip(upper=cand['Qty'])
+    take = take[take > 0]
+    full = take.index[take == cand.loc[take.index, 'Qty']]
+    part = take.index[take < cand.loc[take.index, 'Qty']]
+
+    action = f"จ่ายยาให้ผู้ป่วย ({user_name})"
+    # ล็อตที่ใช้หมด -> เปลี่ยนสถานะทั้งแถว
+    stock.loc[full, ['Record_Status', 'Action_By']] = ['Dispensed', action]
+    # ล็อตที่ใช้บางส่วน -> หักยอดในแถวเดิม แล้วสร้างแถว Dispensed ใหม่เฉพาะส่วนที่จ่ายจริง
+    new_rows = stock.loc[part].copy()
+    new_rows['Qty'] = take[part].values
+    new_rows['Record_Status'] = 'Dispensed'
+    new_rows['Action_By'] = action
+    stock.loc[part, 'Qty'] = stock.loc[part, 'Qty'] - take[part]
+    if len(new_rows): stock = pd.concat([stock, new_rows], ignore_index=True)
+
+    got = take.groupby([cand.loc[take.index, 'Location'], cand.loc[take.index, 'Drug_Name']]).sum()
+    summary = want.to_frame().join(got.rename('Dispensed')).fillna({'Dispensed': 0}).reset_index()
+    summary['Short'] = summary['Want'] - summary['Dispensed']
+    return stock, summary
+
+def _split(stock, idx, qty, changes):
+    # ทำรายการกับล็อตเดียว: ใช้ทั้งล็อต -> แก้แถวเดิม, ใช้บางส่วน -> หักยอดแถวเดิมแล้วเพิ่มแถวใหม่เฉพาะส่วนที่ทำรายการ
+    # (stock ต้องเป็นสำเนาที่แก้ได้แล้ว: inventory.editable)
+    left = stock.loc[idx, 'Qty'] - qty
+    if left <= 0:
+        stock.loc[idx, list(changes)] = list(changes.values())
+        return stock
+    stock.loc[idx, 'Qty'] = left
+    new_row = stock.loc[idx].copy()
+    new_row['Qty'] = qty
+    for col, val in changes.items(): new_row[col] = val
+    return pd.concat([stock, pd.DataFrame([new_row])], ignore_index=True)
+
+def dispose(stock, idx, qty, user_name):
+    # 🗑️ ทิ้งยาจากล็อตแถว idx จำนวน qty
+    return _split(inventory.editable(stock), idx, qty, {'Record_Status': 'Disposed', 'Action_By': f"ทิ้งโดย {user_name}"})
+
+def transfer(stock, idx, qty, to_location, user_name):
+    # 🔄 โอนยาจากล็อตแถว idx ไปหน่วยงาน to_location
+    return transfer_many(stock, [(idx, qty, to_location)], user_name)
+
+def transfer_many(stock, moves, user_name):
+    # โอนหลายรายการในครั้งเดียว moves = [(แถว, จำนวน, หน่วยงานปลายทาง)] (แถวเดียวกันแบ่งโอนหลายที่ได้ ไล่ตามลำดับ)
+    stock = inventory.editable(stock)
+    for idx, qty, to_location in moves:
+        stock = _split(stock, idx, qty, {'Location': to_location, 'Status': 'Transferred', 'Action_By': user_name})
+    return stock
+
+def thaw(stock, idx, today):
+    # 💧 ละลายยาแช่แข็ง: วันหมดอายุใหม่ = ที่มาก่อนระหว่าง (วันนี้ + BUD ละลาย) กับ (วันหมดอายุตอนแช่แข็ง + BUD ละลาย)
+    # คืน (สต็อกใหม่, วันหมดอายุใหม่)
+    stock = inventory.editable(stock)
+    row = stock.loc[idx]
+    match = re.search(r'\d+', str(row.get('BUD_Thawed', row.get('BUD_Cold', 14))))
+    bud = pd.Timedelta(days=int(match.group()) if match else 14)
+    expiry = min(pd.Timestamp(today) + bud, pd.to_datetime(row['Expiry_Date']) + bud)
+    stock.loc[idx, ['Status', 'Expiry_Date']] = ['Thawed', expiry]
+    return stock, expiry
+
+def expired(stock, today, locations=None):
+    # แถวที่ยังอยู่ในตู้แต่เลยวันหมดอายุแล้ว (หมดอายุก่อนวันนี้) ทุกหน่วยงาน หรือเฉพาะ locations
+    exp = pd.to_datetime(stock['Expiry_Date'], errors='coerce')
+    hit = (stock['Record_Status'] == 'In_Stock') & (stock['Qty'] > 0) & (exp < pd.Timestamp(today).normalize())
+    if locations is not None: hit &= stock['Location'].isin(list(locations))
+    return stock.index[hit]
+
+def sweep_expired(stock, today, user_name, locations=None):
+    # 🧹 ทิ้งยาหมดอายุทุกล็อตในครั้งเดียว -> คืน (สต็อกใหม่, สรุปต่อหน่วยงาน/ยา: Lots, Qty, Value)
+    stock = inventory.editable(stock)
+    idx = expired(stock, today, locations)
+    hit = stock.loc[idx]
+    value = hit['Qty'] * pd.to_numeric(hit['Unit_Cost'], errors='coerce').fillna(0) if 'Unit_Cost' in hit.columns else 0.0
+    summary = hit.assign(Value=value).groupby(['Location', 'Drug_Name'], observed=True) \
+        .agg(Lots=('Batch_ID', 'size'), Qty=('Qty', 'sum'), Value=('Value', 'sum')).reset_index()
+    stock.loc[idx, ['Record_Status', 'Action_By']] = ['Disposed', f"ทิ้งยาหมดอายุอัตโนมัติ ({user_name})"]
+    return stock, summary
+
+# 📥 รับยาเข้าทีละหลายล็อตจากไฟล์ใบส่งของ (CSV/Excel) ตรวจทุกบรรทัดพร้อมกัน
+MANIFEST_COLS = ['Drug_Name', 'Batch_ID', 'Location', 'Qty', 'Date_Produced', 'Expiry_Date']
+
+def bud_days(drugs):
+    # อายุยาหลังเตรียม (วัน) ต่อชื่อยา: BUD_Thawed ถ้ามี ไม่งั้น BUD_Cold ไม่มีทั้งคู่ = 30 วัน
+    col = 'BUD_Thawed' if 'BUD_Thawed' in drugs.columns else ('BUD_Cold' if 'BUD_Cold' in drugs.columns else None)
+    if col is None: return pd.Series(30, index=drugs.index)
+    return pd.to_numeric(drugs[col].astype(str).str.extract(r'(\d+)')[0], errors='coerce').fillna(30).astype(int)
+
+def _norm_col(c):
+    return re.sub(r'[\s_]+', '', str(c)).lower()
+
+def receive_manifest(manifest, drugs, stock, locations, user_name, today, received=None):
+    # คืนตารางตรวจสอบทีละบรรทัด: คอลัมน์แบบแท็บ Stock + Line (บรรทัดในไฟล์) + Problem ('' = ผ่าน)
+    # received = ฟังก์ชัน (รายการเลข Batch) -> เลขที่เคยรับเข้าแล้ว รวมล็อตที่จ่าย/ทิ้งไปอยู่ในประวัติ (เช่น store.received_batches)
+    # ล็อตเดียวกันส่งหลายห้อง -> ตั้งชื่อ Batch เป็น "เลข (ห้อง)" เหมือนฟอร์มรับเข้าทีละรายการ
+    wanted = {_norm_col(c): c for c in MANIFEST_COLS}
+    m = manifest.rename(columns=lambda c: wanted.get(_norm_col(c), c)).reindex(columns=MANIFEST_COLS).reset_index(drop=True)
+    m = m.apply(lambda s: s.astype(str).str.strip().replace(['nan', 'NaT', 'None'], ''))
+    problems = {}
+
+    # 1. ชื่อยา: จับคู่กับฐานข้อมูลยาแบบไม่สนช่องว่าง/ตัวพิมพ์ แล้วใช้ชื่อตามฐานข้อมูล
+    master = drugs.assign(_key=inventory.merge_key(drugs['Drug_Name']), _bud=bud_days(drugs)).drop_duplicates('_key').set_index('_key')
+    key = inventory.merge_key(m['Drug_Name'])
+    name = key.map(master['Drug_Name'])
+    problems['drug'] = name.isna().map({True: 'ไม่พบชื่อยาในฐานข้อมูล', False: ''})
+    frozen = key.map(master['Type']).astype(str).str.strip().eq('Frozen') if 'Type' in master.columns else pd.Series(False, index=m.index)
+
+    # 2. ห้อง / จำนวน / วันที่
+    problems['loc'] = (~m['Location'].isin(list(locations))).map({True: 'ไม่รู้จักหน่วยงาน', False: ''})
+    qty = pd.to_numeric(m['Qty'], errors='coerce')
+    problems['qty'] = (~(qty > 0)).map({True: 'จำนวนต้องมากกว่า 0', False: ''})
+    produced = pd.to_datetime(m['Date_Produced'].replace('', today.strftime('%Y-%m-%d')), errors='coerce')
+    problems['date'] = produced.isna().map({True: 'วันผลิตอ่านไม่ออก', False: ''})
+    # วันหมดอายุ: ใช้ตามไฟล์ถ้าระบุมา ไม่งั้นคิดจากวันผลิต + BUD ของยา
+    given = m['Expiry_Date'] != ''
+    expiry = produced + pd.to_timedelta(key.map(master['_bud']).fillna(30), unit='D')
+    expiry = expiry.where(~given, pd.to_datetime(m['Expiry_Date'].where(given), errors='coerce'))
+    problems['exp'] = (given & expiry.isna()).map({True: 'วันหมดอายุอ่านไม่ออก', False: ''})
+
+    # 3. เลข Batch: ห้ามว่าง ห้ามซ้ำในไฟล์ (เลข+ห้องเดียวกัน) ห้ามซ้ำกับที่มีในสต็อก และห้ามซ้ำกับล็อตเก่าในประวัติ (อัปโหลดไฟล์เดิมซ้ำ)
+    spread = m.groupby('Batch_ID')['Location'].transform('nunique') > 1
+    batch = m['Batch_ID'].where(~spread, m['Batch_ID'] + ' (' + m['Location'] + ')')
+    in_stock = stock['Batch_ID'].astype(str) if 'Batch_ID' in stock.columns else pd.Series(dtype=str)
+    seen = received(batch.tolist()) if received else set()
+    problems['batch'] = pd.Series('', index=m.index) \
+        .mask(batch.duplicated(keep=False), 'เลข Batch ซ้ำในไฟล์') \
+        .mask(batch.isin(seen), 'เลข Batch นี้เคยรับเข้าแล้ว (อยู่ในประวัติจ่าย/ทิ้ง)') \
+        .mask(batch.isin(in_stock), 'มีเลข Batch นี้ในสต็อกแล้ว') \
+        .mask(m['Batch_ID'] == '', 'ไม่มีเลข Batch')
+
+    problem = pd.Series('', index=m.index)
+    for p in problems.values(): problem = problem.str.cat(p, sep=', ')
+    return pd.DataFrame({
+        'Line': m.index + 2,  # บรรทัดในไฟล์ (บรรทัดแรกเป็นหัวตาราง)
+        'Date_Produced': produced.dt.strftime('%Y-%m-%d'), 'Drug_Name': name.fillna(m['Drug_Name']), 'Batch_ID': batch,
+        'Qty': qty, 'Expiry_Date': expiry.dt.strftime('%Y-%m-%d'), 'Location': m['Location'],
+        'Status': frozen.map({True: 'Frozen', False: 'Active'}), 'Is_Saved': 'FALSE',
+        'Action_By': user_name, 'Record_Status': 'In_Stock',
+        'Problem': problem.str.replace(r'(, )+', ', ', regex=True).str.strip(', '),
+    })
@@ -0,0 +1,995 @@
+# 🗄️ ชั้นจัดเก็บข้อมูลของ Smart Extemp Inventory
+# - Google Sheets ยังเป็นต้นฉบับที่เภสัชกรเปิดแก้ด้วยมือได้
+# - SQLiteMirror เก็บสำเนาไว้ในเครื่อง ให้แอปอ่านได้ในระดับมิลลิวินาที และยังบันทึกได้ตอนเน็ตหลุด
+# - MemoryBackend เป็นชีตปลอมในหน่วยความจำ ใช้แทน Google Sheets ตอนทดสอบ
+import collections
+import contextlib
+import difflib
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+import metrics
+
+# ไฟล์ Google Sheets ต้นฉบับ (แอปและงานเบื้องหลังใน jobs.py ใช้ไฟล์เดียวกัน)
+SHEET_ID = os.environ.get("SSW_SHEET_ID", "1_fd62tPsJRUONdRYlQ9hX9SOb-hPs7RCoxseK2onzYI")
+TABS = ["Drugs", "Stock", "Locations", "Users"]
+INDEXED_COLS = {'Stock': ['Batch_ID', 'Location', 'Drug_Name', 'Expiry_Date'], 'Drugs': ['Drug_Name']}
+HISTORY_INDEXED_COLS = ['Batch_ID']  # แท็บประวัติ: ใช้เช็คเลข Batch ซ้ำตอนรับยาเข้า
+
+# 🗃️ แท็บ Stock เก็บเฉพาะยาที่ยังอยู่ในตู้ (In_Stock) ส่วนประวัติจ่าย/ทิ้งย้ายไปแท็บรายเดือน History_YYYY_MM
+# (แบ่งตามเดือนของ Date_Produced ให้ตรงกับช่วงวันที่ที่หน้าผู้บริหารใช้กรอง)
+HISTORY_PREFIX = "History_"
+HISTORY_STATUSES = ['Dispensed', 'Disposed']
+ROLLUP_COLS = ['day', 'location', 'drug', 'record_status', 'transferred']
+# 🔑 คอลัมน์ที่ระบุว่าเป็นแถวเดียวกัน ใช้หาแถวเป้าหมายในชีตใหม่ตอนส่งคิว ถ้าตำแหน่งเลื่อนไปเพราะมีคนอื่นเขียนก่อน (locate_changes)
+ROW_KEYS = {'Stock': ['Batch_ID', 'Location'], 'Drugs': ['Drug_Name']}
+# ✍️ คอลัมน์ยอดสะสม: ถ้าสองคนแก้แถวเดียวกันพร้อมกัน ให้นำส่วนต่างของแต่ละคนมารวมกันแทนการเขียนทับ (เช่นจ่ายยาคนละ 3 จากล็อตเดียวกัน)
+DELTA_COLS = {'Stock': ['Qty']}
+# รอให้รายการที่บันทึกติดๆ กันเข้าคิวครบก่อน แล้วค่อยรวมส่งขึ้นชีตทีเดียว (วินาที)
+COALESCE_WINDOW = float(os.environ.get("SSW_COALESCE_WINDOW", "0.5"))
+# 🚦 โควตา Sheets API ~60 คำขอ/นาที/ผู้ใช้ -> ทั้งเครื่องแบ่งกันใช้ไม่เกินนี้ (เผื่อไว้ให้คนที่เปิดชีตแก้มือ)
+SHEETS_PER_MINUTE = float(os.environ.get("SSW_SHEETS_PER_MINUTE", "50"))
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# 🔎 แท็บประวัติที่มีในเครื่องแล้ว: ทุกรอบซิงก์ดึงแค่ PROBE_COLS คอลัมน์แรกมาเทียบ เปลี่ยนเมื่อไหร่ค่อยดึงทั้งแท็บ
+PROBE_COLS = 3
+
+
+class WriteConflict(Exception):
+    # แถวที่จะบันทึกถูกคนอื่นแก้/ลบไปก่อนแล้ว และรวมการแก้ไขให้อัตโนมัติไม่ได้ (ไม่มีอะไรถูกบันทึก)
+    def __init__(self, tab, keys):
+        self.tab, self.keys = tab, list(keys)
+        super().__init__(f"{tab}: {', '.join(map(str, self.keys))}")
+
+
+class RemoteUnavailable(Exception):
+    # พักการต่อชีตชั่วคราว (ล้มติดกันหลายครั้ง / โควตาเต็ม) -> ไม่ยิงคำขอซ้ำให้โควตาหมดหนักกว่าเดิม ใช้สำเนาในเครื่องไปก่อน
+    def __init__(self, wait, cause=None):
+        self.retry_at, self.cause = time.monotonic() + wait, cause  # retry_at เทียบกับ time.monotonic()
+        super().__init__(f"พักการเชื่อมต่อ Google Sheets {wait:.0f} วินาที ({cause})")
+
+
+# --- 1. แปลงข้อมูล / เทียบส่วนต่าง ---
+def to_sheet_frame(df, tab_name):
+    # แปลงตารางให้อยู่ในรูปข้อความแบบเดียวกับที่เก็บในชีต (ใช้ทั้งตอนเขียนและตอนเทียบส่วนต่าง)
+    df_clean = df.copy()
+    if tab_name == 'Stock':
+        cols_to_drop = ['Days_Left', 'Total_Value', 'Unit_Cost', 'Type', 'BUD_Cold', 'merge_key']
+        df_clean = df_clean.drop(columns=[c for c in cols_to_drop if c in df_clean.columns], errors='ignore')
+        for col in ['Date_Produced', 'Expiry_Date']:
+            if col in df_clean.columns:
+                df_clean[col] = pd.to_datetime(df_clean[col], errors='coerce').dt.strftime('%Y-%m-%d').fillna('')
+        if 'Qty' in df_clean.columns:
+            # 5.0 -> "5" เพื่อไม่ให้ทุกแถวกลายเป็นแถวที่ถูกแก้ไข
+            q = pd.to_numeric(df_clean['Qty'], errors='coerce')
+            is_int = q.notna() & (q % 1 == 0)
+            df_clean['Qty'] = q.astype(str).where(~is_int, q.where(is_int, 0).astype('int64').astype(str))
+    return df_clean.astype(str).replace(['nan', 'NaT', 'None', '<NA>'], '')
+
+def frame_from_values(values):
+    # เติมช่องว่างท้ายแถวให้ยาวเท่ากันทุกแถว (ชีตตัดเซลล์ว่างท้ายแถวทิ้งมาให้)
+    width = max(map(len, values), default=0)
+    values = [list(r) + [''] * (width - len(r)) for r in values]
+    df = pd.DataFrame(values[1:], columns=values[0]) if values else pd.DataFrame()
+    df.columns = df.columns.astype(str).str.strip()
+    return df
+
+def diff_rows(base, new):
+    # เทียบกับ snapshot ที่โหลดมา: index = ลำดับแถวใน snapshot (0 = แถวที่ 2 ต่อจากหัวตาราง)
+    common = new.index.intersection(base.index)
+    changed = (new.loc[common] != base.loc[common]).any(axis=1)
+    updated = sorted(changed[changed].index.tolist())
+    deleted = sorted(base.index.difference(new.index).tolist())
+    appended = [i for i in new.index if i not in base.index]
+    return updated, deleted, appended
+
+def row_version(row):
+    # "เวอร์ชันของแถว" = hash ของเนื้อหา ใช้ดูว่าแถวไหนถูกแก้ในชีตโดยไม่ต้องโหลดมาเทียบทีละช่อง
+    return hashlib.blake2b('\x1f'.join(map(str, row)).encode(), digest_size=8).hexdigest()
+
+def rebase_row(header, base, mine, theirs, delta_cols=()):
+    # ย้ายการแก้ไขของเรา (base -> mine) ไปลงบนแถวล่าสุด (theirs) ทีละเซลล์ คืน None ถ้าแก้เซลล์เดียวกันคนละค่า
+    out = list(theirs)
+    for k, col in enumerate(header):
+        b, m, t = base[k], mine[k], theirs[k]
+        if m == b: continue
+        if col not in delta_cols:
+            if t != b and t != m: return None
+            out[k] = m
+            continue
+        # คอลัมน์ยอดสะสม: แก้ค่าเดียวกันก็ยังต้องรวมส่วนต่าง (จ่ายคนละ 1 จากยอด 1 = ไม่พอ ไม่ใช่ได้ 0 ตรงกัน)
+        nums = pd.to_numeric(pd.Series([b, m, t]), errors='coerce')
+        if nums.isna().any(): return None
+        v = nums[2] + nums[1] - nums[0]
+        if v < 0: return None  # รวมแล้วติดลบ = ยาไม่พอสำหรับทั้งสองคน
+        out[k] = str(int(v)) if v % 1 == 0 else str(v)
+    return out
+
+def locate_changes(header, current, changes, key_cols=(), delta_cols=()):
+    # ส่วนต่างในคิวอ้างตำแหน่งแถวตอนบันทึก แต่ระหว่างรอส่ง คนอื่น (อีกเครื่อง / jobs.py / แก้ชีตด้วยมือ) อาจแทรก/ลบ/แก้แถวไปแล้ว
+    # หาแถวเป้าหมายในชีตตอนนี้ (current) จากเนื้อหาเดิมของแถว (expect = [(ตำแหน่ง, แถวก่อนแก้)]):
+    #   ตำแหน่งเดิมเวอร์ชันตรง -> ตำแหน่งอื่นที่เวอร์ชันตรง -> แถวที่ key (ROW_KEYS) ตรงเพียงแถวเดียว แล้ว rebase_row การแก้ไขของเรา
+    # คืน (ส่วนต่างที่อ้างตำแหน่งใน current, key ของแถวที่ส่งไม่ได้เพราะถูกแก้ชนกัน/ถูกลบไปแล้ว -> ใช้ตามชีต)
+    expect = {int(p): row for p, row in changes.get('expect', [])}
+    updates = {int(p): row for p, row in changes.get('updates', [])}
+    deletes = [int(p) for p in changes.get('deletes', [])]
+    keys = [header.index(c) for c in key_cols if c in header]
+    by_ver, by_key = {}, {}
+    for j, r in enumerate(current):
+        by_ver.setdefault(row_version(r), []).append(j)
+        if keys: by_key.setdefault(tuple(r[k] for k in keys), []).append(j)
+    taken, moved, conflicts = set(), {}, []
+    for pos in sorted(expect):
+        before = expect[pos]
+        same = [j for j in by_ver.get(row_version(before), []) if j not in taken]
+        if same:
+            j = min(same, key=lambda j: abs(j - pos))
+        else:
+            cand = [j for j in by_key.get(tuple(before[k] for k in keys), []) if j not in taken] if keys else []
+            row = rebase_row(header, before, updates[pos], current[cand[0]], delta_cols) if len(cand) == 1 and pos in updates else None
+            if row is None:
+                conflicts.append(before[keys[0]] if keys else f"แถว {pos + 2}")
+                continue
+            j, updates[pos] = cand[0], row
+        taken.add(j)
+        moved[pos] = j
+    # ตำแหน่งที่ไม่มี expect (คิวรุ่นเก่า) ส่งตามเดิม
+    at = lambda p: moved.get(p, p if p not in expect else None)
+    return {'updates': [(at(p), row) for p, row in updates.items() if at(p) is not None],
+            'deletes': [at(p) for p in deletes if at(p) is not None],
+            'appends': changes.get('appends', [])}, conflicts
+
+def probe_digest(rows, cols=PROBE_COLS):
+    # ลายนิ้วมือของ cols คอลัมน์แรกทุกแถว (ไม่สนแถวว่างท้ายตาราง ที่ชีตตัดทิ้งมาให้)
+    rows = [tuple((list(r) + [''] * cols)[:cols]) for r in rows]
+    while rows and not any(rows[-1]): rows.pop()
+    return hashlib.blake2b(json.dumps(rows, ensure_ascii=False).encode(), digest_size=8).hexdigest()
+
+def coalesce_outbox(entries):
+    # รวมคิวที่ค้างของแต่ละแท็บเป็นคำขอให้น้อยที่สุด: entries = [(id, tab, kind, payload)] เรียงตาม id
+    # คืน [(tab, kind, payload, [id ที่รวมไว้])] เรียงตามแท็บที่เข้าคิวก่อน
+    #   เขียนทับ + แก้ต่อท้าย -> เขียนทับครั้งเดียว, แก้หลายครั้ง -> apply ครั้งเดียว (ต้องรู้จำนวนแถวก่อนแก้ = 'size')
+    groups = {}
+    for entry_id, tab, kind, payload in entries:
+        batch = groups.setdefault(tab, [])
+        last = batch[-1] if batch else None
+        if last and kind == 'apply' and last['header'] == payload['header'] and last['kind'] != 'fixed':
+            if last['kind'] == 'rewrite': apply_changes(last['rows'], payload['changes'])
+            else: _apply_refs(last['refs'], payload['changes'], last['expect'])
+            last['ids'].append(entry_id)
+            continue
+        if kind == 'rewrite':
+            values = payload['values']
+            batch.append({'kind': 'rewrite', 'header': values[0], 'rows': [list(r) for r in values[1:]], 'ids': [entry_id]})
+        elif 'size' in payload:
+            refs, expect = [('base', i, None) for i in range(payload['size'])], {}
+            batch.append({'kind': 'apply', 'header': payload['header'], 'size': payload['size'], 'expect': expect,
+                          'refs': _apply_refs(refs, payload['changes'], expect), 'ids': [entry_id]})
+        else:
+            # รายการเก่าที่ไม่รู้จำนวนแถว -> ส่งตามเดิมทีละรายการ
+            batch.append({'kind': 'fixed', 'header': payload['header'], 'changes': payload['changes'], 'ids': [entry_id]})
+    out = []
+    for tab, batch in groups.items():
+        for b in batch:
+            if b['kind'] == 'rewrite': out.append((tab, 'rewrite', {'values': [b['header']] + b['rows']}, b['ids']))
+            elif b['kind'] == 'fixed': out.append((tab, 'apply', {'header': b['header'], 'changes': b['changes']}, b['ids']))
+            else: out.append((tab, 'apply', {'header': b['header'], 'changes': _changes_of(b['refs'], b['size'], b['expect'])}, b['ids']))
+    return out
+
+def _apply_refs(refs, changes, expect=None):
+    # เหมือน apply_changes แต่จำไว้ว่าแต่ละแถวคือแถวเดิมลำดับที่เท่าไหร่ ('base', i, แถวใหม่หรือ None) หรือแถวใหม่ ('new', None, แถว)
+    # expect = {แถวเดิมลำดับที่ i: เนื้อหาในชีตก่อนแก้} เก็บของรายการแรกที่แตะแถวนั้น (ชีตยังไม่เห็นการแก้ของรายการถัดๆ ไป)
+    if expect is not None:
+        for pos, row in changes.get('expect', []):
+            kind, i, _ = refs[pos]
+            if kind == 'base': expect.setdefault(i, list(row))
+    for pos, row in changes.get('updates', []): refs[pos] = (refs[pos][0], refs[pos][1], list(row))
+    for pos in sorted(changes.get('deletes', []), reverse=True): del refs[pos]
+    refs.extend(('new', None, list(r)) for r in changes.get('appends', []))
+    return refs
+
+def _changes_of(refs, size, expect=None):
+    kept = {i for kind, i, _ in refs if kind == 'base'}
+    out = {'updates': [(i, row) for kind, i, row in refs if kind == 'base' and row is not None],
+           'deletes': [i for i in range(size) if i not in kept],
+           'appends': [row for kind, _, row in refs if kind == 'new']}
+    if expect: out['expect'] = sorted(expect.items())
+    return out
+
+def _runs(positions):
+    # รวมแถวที่อยู่ติดกันเป็นช่วงเดียว [(start, end), ...] เพื่อลดจำนวน range ที่ส่ง
+    runs = []
+    for p in positions:
+        if runs and p == runs[-1][1] + 1: runs[-1][1] = p
+        else: runs.append([p, p])
+    return runs
+
+def indexed_cols(tab):
+    return INDEXED_COLS.get(tab, HISTORY_INDEXED_COLS if tab.startswith(HISTORY_PREFIX) else [])
+
+def history_tab(date_produced):
+    d = str(date_produced)[:7]
+    return f"{HISTORY_PREFIX}{d.replace('-', '_')}" if len(d) == 7 and d[4] == '-' else f"{HISTORY_PREFIX}undated"
+
+def history_tabs_between(start, end):
+    months = pd.period_range(pd.Timestamp(start).to_period('M'), pd.Timestamp(end).to_period('M'), freq='M')
+    return [f"{HISTORY_PREFIX}{p.year}_{p.month:02d}" for p in months]
+
+def split_history(df_safe):
+    # แยกแถวที่จ่าย/ทิ้งแล้วออกจากชุดข้อมูลที่ใช้งานอยู่ -> (แถว In_Stock, {แท็บประวัติ: แถวที่ต้องย้ายไป})
+    if 'Record_Status' not in df_safe.columns: return df_safe, {}
+    cold = df_safe['Record_Status'].isin(HISTORY_STATUSES)
+    if not cold.any(): return df_safe, {}
+    moved = df_safe[cold]
+    return df_safe[~cold], {tab: part for tab, part in moved.groupby(moved['Date_Produced'].map(history_tab), sort=True)}
+
+def rollup_frame(df):
+    # สรุปยอดรายวันต่อ (วันที่รับเข้า, หน่วยงาน, ยา, Record_Status, เคยถูกโอน) ใช้กับหน้าผู้บริหาร
+    if df.empty or not {'Location', 'Drug_Name', 'Qty'}.issubset(df.columns): return pd.DataFrame(columns=ROLLUP_COLS + ['qty'])
+    if 'Record_Status' in df.columns: status = df['Record_Status']
+    else: status = df['Location'].eq('Disposal').map({True: 'Disposed', False: 'In_Stock'})
+    out = pd.DataFrame({
+        'day': pd.to_datetime(df['Date_Produced'], errors='coerce').dt.strftime('%Y-%m-%d').fillna('') if 'Date_Produced' in df.columns else '',
+        'location': df['Location'], 'drug': df['Drug_Name'], 'record_status': status,
+        'transferred': df['Status'].eq('Transferred').astype(int) if 'Status' in df.columns else 0,
+        'qty': pd.to_numeric(df['Qty'], errors='coerce').fillna(0),
+    })
+    return out.groupby(ROLLUP_COLS, as_index=False)['qty'].sum()
+
+def apply_changes(rows, changes):
+    # ใช้ส่วนต่างกับ list ของแถว (ตำแหน่งอ้างอิงสถานะก่อนแก้: แก้ไข -> ลบ -> ต่อท้าย)
+    for pos, row in changes.get('updates', []): rows[pos] = list(row)
+    for pos in sorted(changes.get('deletes', []), reverse=True): del rows[pos]
+    rows.extend(list(r) for r in changes.get('appends', []))
+    return rows
+
+
+# --- 2. BACKENDS (ต้นทางระยะไกล) ---
+def is_retryable(e):
+    # 429 (โควตาเต็ม) / 5xx / เน็ตหลุด = ลองใหม่ได้, 400/403/404 = ผิดที่คำขอ ลองกี่รอบก็ไม่ผ่าน
+    status = getattr(getattr(e, 'response', None), 'status_code', None)
+    return status in RETRY_STATUS if status is not None else isinstance(e, OSError)
+
+def retry_after(e):
+    # ชีตบอกมาเองว่าให้รอกี่วินาที (header Retry-After) ถ้ามี
+    try: return float(e.response.headers.get('Retry-After'))
+    except (AttributeError, TypeError, ValueError): return None
+
+def quota_error(op='read'):
+    # ข้อผิดพลาด 429 หน้าตาเดียวกับที่ gspread โยนออกมาจริง (ใช้กับชีตปลอม)
+    import gspread, requests
+    resp = requests.Response()
+    resp.status_code = 429
+    resp._content = json.dumps({'error': {'code': 429, 'status': 'RESOURCE_EXHAUSTED',
+                                          'message': f"Quota exceeded for quota metric '{op} requests' per minute per user"}}).encode()
+    return gspread.exceptions.APIError(resp)
+
+def quota_faults(rate, seed=None):
+    # 🧪 ให้คำขอของชีตปลอมล้มด้วย 429 แบบสุ่มตามสัดส่วน rate (0-1)
+    rnd = random.Random(seed)
+    def maybe_fail(op):
+        if rnd.random() < rate: raise quota_error(op)
+    return maybe_fail
+
+
+def _col(n):
+    # เลขคอลัมน์ -> ตัวอักษรแบบ A1 (1 = A, 27 = AA)
+    out = ''
+    while n > 0:
+        n, r = divmod(n - 1, 26)
+        out = chr(65 + r) + out
+    return out
+
+
+class TokenBucket:
+    # งบคำขอต่อนาที: เติมทีละนิดตามเวลา ใช้ได้ติดกันไม่เกิน burst ครั้ง ที่เหลือต้องรอคิว
+    def __init__(self, per_minute, burst=None, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or max(per_minute / 6, 1)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.t = clock()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # จองคำขอหนึ่งครั้ง คืนจำนวนวินาทีที่ต้องรอก่อนส่ง (จองแล้วติดลบได้ = ต่อคิวตามลำดับ)
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.t) * self.rate)
+            self.t = now
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, 0.0)
+
+    def refund(self):
+        with self.lock: self.tokens += 1
+
+
+class QuotaGuard:
+    # ด่านหน้าของทุกคำขอ Google Sheets (ใช้ร่วมกันทุก session / thread)
+    # 1. งบคำขอต่อนาที (TokenBucket)  2. ล้มแบบลองใหม่ได้ -> รอแบบ exponential backoff + jitter แล้วลองใหม่
+    # 3. ลองครบแล้วยังล้มติดกัน `failures` ครั้ง -> ตัดวงจร (circuit breaker) พัก `cooldown` วินาที ระหว่างนี้โยน RemoteUnavailable ทันที
+    # 4. พักครบแล้ว (half-open) -> ปล่อยคำขอทดลองแค่คำขอเดียว (ไม่ลองซ้ำ) คนอื่นได้ RemoteUnavailable จนกว่าจะรู้ผล
+    def __init__(self, per_minute=SHEETS_PER_MINUTE, burst=None, retries=4, backoff=1.0, max_backoff=32.0, max_wait=30.0,
+                 failures=3, cooldown=60.0, clock=time.monotonic, sleep=time.sleep, rnd=random.random):
+        self.bucket = TokenBucket(per_minute, burst, clock)
+        self.retries, self.backoff, self.max_backoff, self.max_wait = retries, backoff, max_backoff, max_wait
+        self.failures, self.cooldown = failures, cooldown
+        self.clock, self.sleep, self.rnd = clock, sleep, rnd
+        self.lock = threading.Lock()
+        self.failed = 0          # จำนวนครั้งที่ล้มติดกัน (นับหลังลองใหม่ครบแล้ว)
+        self.open_until = 0.0    # > ตอนนี้ = วงจรตัดอยู่
+        self.trial = False       # มีคำขอทดลองช่วง half-open กำลังวิ่งอยู่
+        self.last_cause = None
+
+    def state(self):
+        if self.open_until > self.clock(): return 'open'
+        return 'half-open' if self.failed >= self.failures else 'closed'
+
+    def call(self, fn, *args, idempotent=True, **kwargs):
+        # idempotent=False (append/ลบแถว/เพิ่มแท็บ): ลองใหม่เฉพาะ 429 ที่ชีตปฏิเสธตั้งแต่แรก ไม่งั้น 5xx ที่จริงๆ ทำไปแล้วจะเพิ่มแถวซ้ำ
+        with self.lock:
+            if self.open_until > self.clock(): raise RemoteUnavailable(self.open_until - self.clock(), self.last_cause)
+            trial = self.failed >= self.failures
+            if trial:
+                if self.trial: raise RemoteUnavailable(self.backoff, "กำลังทดลองเชื่อมต่อใหม่")
+                self.trial = True
+        try: return self._attempts(fn, args, kwargs, idempotent, 0 if trial else self.retries)
+        finally:
+            if trial:
+                with self.lock: self.trial = False
+
+    def _attempts(self, fn, args, kwargs, idempotent, retries):
+        for attempt in range(retries + 1):
+            wait = self.bucket.reserve()
+            if wait > self.max_wait:
+                self.bucket.refund()
+                raise RemoteUnavailable(wait, "งบคำขอต่อนาทีเต็ม")
+            if wait:
+                metrics.count('sheets.throttled')
+                with metrics.timer('sheets.throttle'): self.sleep(wait)
+            try:
+                out = fn(*args, **kwargs)
+            except Exception as e:
+                status = getattr(getattr(e, 'response', None), 'status_code', None)
+                if not is_retryable(e) or (not idempotent and status != 429): raise
+                metrics.count('sheets.quota_error' if status == 429 else 'sheets.transient_error')
+                if attempt == retries:
+                    self._failed(e)
+                    raise
+                # full jitter: สุ่มรอ 0..(1, 2, 4, ... วินาที) ไม่ให้ทุก thread กลับมายิงพร้อมกัน
+                delay = max(self.rnd() * min(self.max_backoff, self.backoff * 2 ** attempt), retry_after(e) or 0)
+                metrics.count('sheets.retry')
+                with metrics.timer('sheets.backoff'): self.sleep(delay)
+                continue
+            with self.lock: self.failed, self.open_until = 0, 0.0
+            return out
+
+    def _failed(self, e):
+        with self.lock:
+            self.failed += 1
+            self.last_cause = e
+            if self.failed >= self.failures:
+                self.open_until = self.clock() + self.cooldown
+                metrics.count('sheets.breaker_open')
+
+# ทุก backend มี 3 เมธอดเหมือนกัน: fetch(tabs) / apply(tab, header, changes) / rewrite(tab, values)
+class SheetsBackend:
+    # client = gspread client หรือฟังก์ชันที่คืน client (import/ต่อ gspread ตอนส่งคำขอแรก ไม่ถ่วงตอนเปิดแอป)
+    def __init__(self, client, sheet_id, guard=None):
+        self.client = client
+        self.sheet_id = sheet_id
+        self.guard = guard or QuotaGuard()
+        self._call = self.guard.call
+        self._gsheet = None
+        self._worksheets = None
+        self._worksheets_at = 0.0
+
+    @property
+    def gsheet(self):
+        # เปิดไฟล์ตอนใช้งานครั้งแรก (เปิดแอปตอนเน็ตหลุดได้ ยังอ่านสำเนาในเครื่องไปก่อน) แล้วเก็บ handle ไว้ใช้ต่อ
+        if self._gsheet is None:
+            metrics.count('sheets.open_by_key')
+            if callable(self.client):
+                with metrics.timer('sheets.connect'): self.client = self.client()
+            with metrics.timer('sheets.open'): self._gsheet = self._call(self.client.open_by_key, self.sheet_id)
+        return self._gsheet
+
+    def worksheets(self, refresh=False):
+        if self._worksheets is None or refresh:
+            metrics.count('sheets.worksheets')
+            with metrics.timer('sheets.worksheets'): self._worksheets = {ws.title: ws for ws in self._call(self.gsheet.worksheets)}
+            self._worksheets_at = time.monotonic()
+        return self._worksheets
+
+    def fetch(self, tabs):
+        # ⚡ ดึงทุกแท็บในคำขอเดียว (ข้ามแท็บที่ไม่มีในไฟล์ ไม่งั้นทั้งคำขอจะ error)
+        names = [n for n in tabs if n in self.worksheets()]
+        if not names: return {}
+        metrics.count('sheets.values_batch_get')
+        with metrics.timer('sheets.fetch'):
+            resp = self._call(self.gsheet.values_batch_get, [f"'{n}'" for n in names])
+        out = dict(zip(names, [vr.get('values', []) for vr in resp.get('valueRanges', [])]))
+        metrics.payload('sheets.read', out)
+        return out
+
+    def probe(self, tabs, cols=PROBE_COLS):
+        # cols คอลัมน์แรกของหลายแท็บในคำขอเดียว (ไว้ดูว่าแท็บไหนเปลี่ยน) แท็บที่ยังไม่มีในไฟล์ = ไม่ส่งคืน
+        # มีแท็บที่เครื่องเราไม่รู้จัก (เช่นงานกลางคืนสร้างประวัติเดือนใหม่) -> ขอรายชื่อแท็บใหม่ แต่ไม่บ่อยกว่า 5 นาทีครั้ง
+        if any(n not in self.worksheets() for n in tabs) and time.monotonic() - self._worksheets_at > 300: self.worksheets(refresh=True)
+        names = [n for n in tabs if n in self.worksheets()]
+        if not names: return {}
+        metrics.count('sheets.values_batch_get')
+        with metrics.timer('sheets.probe'):
+            resp = self._call(self.gsheet.values_batch_get, [f"'{n}'!A:{_col(cols)}" for n in names])
+        return dict(zip(names, [vr.get('values', []) for vr in resp.get('valueRanges', [])]))
+
+    def apply(self, tab, header, changes):
+        with metrics.timer('sheets.apply'): self._apply(tab, header, changes)
+        metrics.payload('sheets.write', changes)
+
+    def _worksheet(self, tab, header):
+        if tab not in self.worksheets():
+            # แท็บใหม่ (เช่นประวัติเดือนใหม่) -> สร้างแท็บพร้อมหัวตารางให้อัตโนมัติ
+            ws = self._call(self.gsheet.add_worksheet, title=tab, rows=1, cols=max(len(header), 1), idempotent=False)
+            self._call(ws.update, [header], 'A1')
+            metrics.count('sheets.add_worksheet'); metrics.count('sheets.update')
+            self.worksheets(refresh=True)
+        return self.worksheets()[tab]
+
+    def _apply(self, tab, header, changes):
+        worksheet = self._worksheet(tab, header)
+        last_col = _col(len(header))
+        # 1. แถวที่ถูกแก้ไข -> batch update ครั้งเดียว (ตำแหน่งยังตรงเพราะยังไม่ได้ลบแถว)
+        updates = dict(changes.get('updates', []))
+        if updates:
+            ranges = [{'range': f"A{s + 2}:{last_col}{e + 2}", 'values': [updates[p] for p in range(s, e + 1)]}
+                      for s, e in _runs(sorted(updates))]
+            self._call(worksheet.batch_update, ranges)
+            metrics.count('sheets.values_batch_update')
+        # 2. แถวที่ถูกลบ -> ลบจากล่างขึ้นบนในคำขอเดียว
+        deletes = sorted(set(changes.get('deletes', [])))
+        if deletes:
+            reqs = [{'deleteDimension': {'range': {'sheetId': worksheet.id, 'dimension': 'ROWS', 'startIndex': s + 1, 'endIndex': e + 2}}}
+                    for s, e in reversed(_runs(deletes))]
+            self._call(self.gsheet.batch_update, {'requests': reqs}, idempotent=False)
+            metrics.count('sheets.batch_update')
+        # 3. แถวใหม่ -> append ครั้งเดียว
+        if changes.get('appends'):
+            self._call(worksheet.append_rows, changes['appends'], table_range='A1', idempotent=False)
+            metrics.count('sheets.append_rows')
+
+    def rewrite(self, tab, values):
+        # 🧹 Compact/Repair: เขียนทับทั้งแผ่นโดยไม่ clear ก่อน (คนที่โหลดระหว่างนี้จะไม่เจอชีตว่าง) แล้วค่อยล้างส่วนเกินท้ายตาราง
+        worksheet = self._worksheet(tab, values[0])
+        with metrics.timer('sheets.rewrite'):
+            self._call(worksheet.update, values, 'A1')
+            last_col = _col(len(values[0]) + 1)
+            self._call(worksheet.batch_clear, [f"A{len(values) + 1}:ZZ", f"{last_col}1:ZZ"])
+        metrics.count('sheets.update'); metrics.count('sheets.batch_clear')
+        metrics.payload('sheets.write', values)
+
+
+class MemoryBackend:
+    # 🧪 ชีตปลอมในหน่วยความจำ: ใช้แทน SheetsBackend ตอนทดสอบ (จดทุกคำขอไว้ใน calls)
+    # faults = ฟังก์ชันที่โยน error ใส่บางคำขอ เช่น quota_faults(0.3) -> ทดสอบ QuotaGuard/ข้อมูลค้างได้โดยไม่ต้องต่อเน็ต
+    def __init__(self, tables=None, faults=None, guard=None):
+        self.tables = {tab: [list(r) for r in values] for tab, values in (tables or {}).items()}
+        self.calls = []
+        self.faults = faults
+        self.guard = guard or QuotaGuard()
+
+    @classmethod
+    def from_json(cls, path, **kwargs):
+        with open(path, encoding='utf-8') as f: return cls(json.load(f), **kwargs)
+
+    def _request(self, op):
+        self.calls.append(op)
+        if self.faults: self.faults(op[0])
+
+    def fetch(self, tabs):
+        self.guard.call(self._request, ('fetch', tuple(tabs)))
+        return {t: [list(r) for r in self.tables[t]] for t in tabs if t in self.tables}
+
+    def probe(self, tabs, cols=PROBE_COLS):
+        self.guard.call(self._request, ('probe', tuple(tabs)))
+        return {t: [list(r[:cols]) for r in self.tables[t]] for t in tabs if t in self.tables}
+
+    def apply(self, tab, header, changes):
+        self.guard.call(self._request, ('apply', tab))
+        values = self.tables.setdefault(tab, [list(header)])
+        self.tables[tab] = values[:1] + apply_changes(values[1:], changes)
+
+    def rewrite(self, tab, values):
+        self.guard.call(self._request, ('rewrite', tab))
+        self.tables[tab] = [list(r) for r in values]
+
+
+# --- 3. LOCAL MIRROR ---
+class SQLiteMirror:
+    # สำเนาในเครื่องของทุกแท็บ: แต่ละแท็บเป็นตาราง t_<ชื่อแท็บ> มีคอลัมน์ระบบ
+    #   _rid = รหัสแถวถาวรในเครื่อง, _pos = ลำดับแถวในชีต, _ver = เวอร์ชันของแถว (hash เนื้อหา)
+    # การเขียนจะลงเครื่องทันทีแล้วเข้าคิว mirror_outbox ให้ thread เบื้องหลังส่งขึ้นชีตทีหลัง
+    def __init__(self, path, remote, tabs=TABS):
+        self.remote = remote
+        self.tabs = list(tabs)
+        if path != ':memory:' and os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.RLock()
+        self.last_pull = 0.0
+        self.last_error = None
+        self.conflicts = collections.deque(maxlen=20)  # รายการที่ส่งขึ้นชีตไม่ได้เพราะแถวถูกคนอื่นแก้/ลบก่อน (ล่าสุดอยู่ท้าย)
+        self._wanted = set()  # แท็บที่หน้าเว็บฝากให้ thread เบื้องหลังโหลดให้
+        self._wake = threading.Event()
+        self._thread = None
+        self._in_tx = False
+        with self.lock:
+            if path != ':memory:': self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS mirror_tables (tab TEXT PRIMARY KEY, header TEXT, version INTEGER)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS mirror_outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, tab TEXT, kind TEXT, payload TEXT, created REAL)")
+            # แท็บที่สร้างในเครื่องก่อนได้ดึงของจริงจากชีต (เช่นเพิ่มประวัติตอนออฟไลน์) ต้องดึงมาเติมทีหลัง
+            self.db.execute("CREATE TABLE IF NOT EXISTS mirror_stale (tab TEXT PRIMARY KEY)")
+            # 📊 ยอดสรุปรายวัน อัปเดตทีละส่วนทุกครั้งที่แถวใน Stock/ประวัติเปลี่ยน (ไม่ต้องไล่ทุกแถวตอนเปิดหน้าผู้บริหาร)
+            fresh = self.db.execute("SELECT name FROM sqlite_master WHERE name = 'rollup_daily'").fetchone() is None
+            self.db.execute("CREATE TABLE IF NOT EXISTS rollup_daily (day TEXT, location TEXT, drug TEXT, record_status TEXT, transferred INTEGER, qty REAL, "
+                            "PRIMARY KEY (day, location, drug, record_status, transferred))")
+            if fresh: self.rebuild_rollup()
+            # 🕰️ เวลาที่ดึงชีตครบทุกแท็บสำเร็จล่าสุด (จำไว้ข้ามการรีสตาร์ต เพื่อบอกผู้ใช้ว่าข้อมูลในเครื่องเป็นของเมื่อไหร่)
+            self.db.execute("CREATE TABLE IF NOT EXISTS mirror_meta (key TEXT PRIMARY KEY, value TEXT)")
+            r = self.db.execute("SELECT value FROM mirror_meta WHERE key = 'last_pull'").fetchone()
+            if r: self.last_pull = float(r[0])
+            # ไฟล์สำเนาเก่าที่สร้างก่อนมี index เลข Batch ในแท็บประวัติ
+            for tab, header in self.db.execute("SELECT tab, header FROM mirror_tables").fetchall(): self._index(tab, json.loads(header))
+
+    # ---------- อ่าน ----------
+    @staticmethod
+    def _t(tab): return '"t_' + tab.replace('"', '""') + '"'
+
+    def header(self, tab):
+        r = self.db.execute("SELECT header FROM mirror_tables WHERE tab=?", (tab,)).fetchone()
+        return json.loads(r[0]) if r else None
+
+    def versions(self):
+        with self.lock:
+            return dict(self.db.execute("SELECT tab, version FROM mirror_tables").fetchall())
+
+    def data_version(self):
+        # ใช้เป็น key ของ cache ฝั่งแอป: เปลี่ยนทุกครั้งที่มีการบันทึกในเครื่องหรือดึงของใหม่จากชีต
+        v = self.versions()
+        return tuple(v.get(t, 0) for t in self.tabs)
+
+    def is_empty(self):
+        return not self.versions()
+
+    def stale_since(self):
+        # ต่อชีตไม่ได้ -> คืนเวลา (epoch) ของข้อมูลชุดล่าสุดที่ดึงมาได้ (0 = ยังไม่เคยดึงสำเร็จ), ต่อได้ปกติ -> None
+        return None if self.last_error is None else self.last_pull
+
+    def read(self, tab, **where):
+        # คืน (DataFrame ข้อความเรียงตามลำดับในชีต, list ของ (_rid, _ver) ที่ตรงกับแต่ละแถว)
+        # where รองรับการกรองด้วยคอลัมน์ที่มี index เช่น read('Stock', Location='ER')
+        with self.lock:
+            header = self.header(tab)
+            if header is None: return pd.DataFrame(), []
+            cond, args = [], []
+            for col, val in where.items():
+                cond.append(f"c{header.index(col)} = ?"); args.append(val)
+            sql = f"SELECT _rid, _ver, {', '.join(f'c{i}' for i in range(len(header))) or 'NULL'} FROM {self._t(tab)}"
+            if cond: sql += " WHERE " + " AND ".join(cond)
+            rows = self.db.execute(sql + " ORDER BY _pos", args).fetchall()
+        keys = [(r[0], r[1]) for r in rows]
+        df = pd.DataFrame([r[2:] for r in rows], columns=header) if header else pd.DataFrame(index=range(len(rows)))
+        return df, keys
+
+    def pending(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM mirror_outbox").fetchone()[0]
+
+    def status(self, ticket):
+        # สถานะของการบันทึกหนึ่งครั้ง (ticket ที่ append/save/rewrite คืนมา): 'synced' / 'queued' / 'offline'
+        if ticket is None: return 'synced'
+        with self.lock:
+            left = self.db.execute("SELECT 1 FROM mirror_outbox WHERE id <= ? LIMIT 1", (ticket,)).fetchone()
+        if left is None: return 'synced'
+        return 'offline' if self.last_error is not None else 'queued'
+
+    def rollup(self, start, end, locations):
+        # ยอดรวมตามช่วงวันที่รับเข้า แยกตาม ยา/Record_Status/เคยถูกโอน (จำนวนแถว ~ วัน × หน่วยงาน ไม่ขึ้นกับจำนวนล็อต)
+        locations = list(locations)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT drug, record_status, transferred, SUM(qty) FROM rollup_daily "
+                f"WHERE day BETWEEN ? AND ? AND location IN ({', '.join('?' * len(locations)) or 'NULL'}) "
+                "GROUP BY drug, record_status, transferred", (str(start), str(end), *locations)).fetchall()
+        return pd.DataFrame(rows, columns=['Drug_Name', 'Record_Status', 'Transferred', 'Qty'])
+
+    def received_batches(self, batches):
+        # เลข Batch ที่เคยรับเข้าแล้ว: ยังอยู่ใน Stock หรือจ่าย/ทิ้งไปแล้ว (แท็บประวัติที่มีในเครื่อง) -> query เดียวผ่าน index เลข Batch
+        wanted = json.dumps(sorted({str(b) for b in batches if str(b)}), ensure_ascii=False)
+        with self.lock:
+            tabs = [(tab, json.loads(h)) for tab, h in self.db.execute("SELECT tab, header FROM mirror_tables").fetchall() if self._rolls(tab)]
+            parts = [f"SELECT c{h.index('Batch_ID')} FROM {self._t(tab)} WHERE c{h.index('Batch_ID')} IN (SELECT value FROM json_each(?))"
+                     for tab, h in tabs if 'Batch_ID' in h]
+            if not parts: return set()
+            return {r[0] for r in self.db.execute(' UNION '.join(parts), [wanted] * len(parts))}
+
+    def dispensed_by_produced(self, start, end):
+        # ยอด Dispensed ต่อ (หน่วยงาน, ยา) ของล็อตที่ *ผลิต/รับเข้า* (Date_Produced) ในช่วงวันที่ -- ชีตไม่มีคอลัมน์วันที่จ่าย
+        # ตารางสรุปรายวันจึงผูกกับ Date_Produced เหมือนพาร์ทิชันประวัติ ใช้แทนอัตราการใช้ได้เพราะยาผลิตเองอายุสั้น จ่ายหมดไม่นานหลังผลิต
+        # (ล็อตที่ผลิตช่วงท้ายๆ ยังจ่ายไม่หมด -> อัตราที่ได้ต่ำกว่าจริงเล็กน้อย = แนะนำโอนแบบระวังไว้ก่อน)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT location, drug, SUM(qty) FROM rollup_daily WHERE record_status = 'Dispensed' AND day BETWEEN ? AND ? "
+                "GROUP BY location, drug", (str(start), str(end))).fetchall()
+        return pd.DataFrame(rows, columns=['Location', 'Drug_Name', 'Qty'])
+
+    # ---------- ยอดสรุปรายวัน ----------
+    def _rolls(self, tab):
+        return tab == 'Stock' or tab.startswith(HISTORY_PREFIX)
+
+    def _rows_of(self, tab, rids=None):
+        n = len(self.header(tab) or [])
+        if not n: return []
+        sql = f"SELECT {', '.join(f'c{i}' for i in range(n))} FROM {self._t(tab)}"
+        if rids is None: return self.db.execute(sql).fetchall()
+        rids = list(rids)
+        return [r for k in range(0, len(rids), 500)
+                for r in self.db.execute(sql + f" WHERE _rid IN ({', '.join('?' * len(rids[k:k + 500]))})", rids[k:k + 500])]
+
+    def _rollup(self, tab, rows, sign):
+        header = self.header(tab)
+        if not rows or not header or not self._rolls(tab): return
+        agg = rollup_frame(pd.DataFrame([list(r) for r in rows], columns=header))
+        if agg.empty: return
+        agg['qty'] *= sign
+        self.db.executemany("INSERT INTO rollup_daily (day, location, drug, record_status, transferred, qty) VALUES (?, ?, ?, ?, ?, ?) "
+                            "ON CONFLICT (day, location, drug, record_status, transferred) DO UPDATE SET qty = qty + excluded.qty",
+                            [(*r[:4], int(r[4]), float(r[5])) for r in agg.itertuples(index=False)])
+
+    def rebuild_rollup(self):
+        with self.lock:
+            self.db.execute("DELETE FROM rollup_daily")
+            for (tab,) in self.db.execute("SELECT tab FROM mirror_tables").fetchall():
+                self._rollup(tab, self._rows_of(tab), +1)
+
+    # ---------- เขียนในเครื่อง ----------
+    def _create(self, tab, header):
+        t = self._t(tab)
+        if self.header(tab) is not None: self._rollup(tab, self._rows_of(tab), -1)
+        self.db.execute(f"DROP TABLE IF EXISTS {t}")
+        cols = ''.join(f", c{i} TEXT" for i in range(len(header)))
+        self.db.execute(f"CREATE TABLE {t} (_rid INTEGER PRIMARY KEY, _pos INTEGER, _ver TEXT{cols})")
+        self.db.execute(f'CREATE INDEX "ix_{tab}__pos" ON {t}(_pos)')
+        self._index(tab, header)
+        self.db.execute("INSERT OR REPLACE INTO mirror_tables (tab, header, version) VALUES (?, ?, COALESCE((SELECT version FROM mirror_tables WHERE tab=?), 0))",
+                        (tab, json.dumps(header, ensure_ascii=False), tab))
+
+    def _index(self, tab, header):
+        for col in indexed_cols(tab):
+            if col in header: self.db.execute(f'CREATE INDEX IF NOT EXISTS "ix_{tab}_{col}" ON {self._t(tab)}(c{header.index(col)})')
+
+    def _insert(self, tab, start_pos, rows, positions=None):
+        n = len(self.header(tab))
+        rows = [list(r)[:n] + [''] * (n - len(r)) for r in rows]
+        positions = positions or [start_pos + i for i in range(len(rows))]
+        sql = f"INSERT INTO {self._t(tab)} (_pos, _ver{''.join(f', c{i}' for i in range(n))}) VALUES (?, ?{', ?' * n})"
+        self.db.executemany(sql, [(p, row_version(r), *r) for p, r in zip(positions, rows)])
+        self._rollup(tab, rows, +1)
+
+    def _rows_by_rid(self, tab, rids):
+        n = len(self.header(tab))
+        sql = f"SELECT _rid, {', '.join(f'c{i}' for i in range(n))} FROM {self._t(tab)} WHERE _rid = ?"
+        return {r[0]: list(r[1:]) for rid in rids for r in self.db.execute(sql, (rid,))}
+
+    def _update(self, tab, rid, row):
+        n = len(self.header(tab))
+        self._rollup(tab, self._rows_of(tab, [rid]), -1)
+        sets = ', '.join(f"c{i} = ?" for i in range(n))
+        self.db.execute(f"UPDATE {self._t(tab)} SET _ver = ?, {sets} WHERE _rid = ?", (row_version(row), *row, rid))
+        self._rollup(tab, [row], +1)
+
+    def _delete(self, tab, rids):
+        self._rollup(tab, self._rows_of(tab, rids), -1)
+        self.db.executemany(f"DELETE FROM {self._t(tab)} WHERE _rid = ?", [(rid,) for rid in rids])
+
+    def _renumber(self, tab):
+        t = self._t(tab)
+        rids = [r[0] for r in self.db.execute(f"SELECT _rid FROM {t} ORDER BY _pos")]
+        self.db.executemany(f"UPDATE {t} SET _pos = ? WHERE _rid = ?", list(enumerate(rids)))
+
+    def _bump(self, tab):
+        self.db.execute("UPDATE mirror_tables SET version = version + 1 WHERE tab = ?", (tab,))
+
+    def _replace(self, tab, header, rows):
+        self._create(tab, header)
+        self._insert(tab, 0, rows)
+        self._bump(tab)
+
+    def _enqueue(self, tab, kind, payload):
+        return self.db.execute("INSERT INTO mirror_outbox (tab, kind, payload, created) VALUES (?, ?, ?, ?)",
+                        (tab, kind, json.dumps(payload, ensure_ascii=False), time.time()))
+
+    def _append_local(self, tab, header, rows):
+        local = self.header(tab)
+        if not local:
+            self._create(tab, header)
+            # ไม่เคยดึงแท็บนี้มาก่อน (ในชีตอาจมีแถวเก่าอยู่แล้ว) -> ส่งของเราขึ้นไปก่อนแล้วค่อยดึงมาเติม
+            if local is None: self.db.execute("INSERT OR IGNORE INTO mirror_stale (tab) VALUES (?)", (tab,))
+            local = header
+        elif local != header:
+            # หัวตารางแท็บปลายทางเรียงไม่เหมือนกัน -> จัดคอลัมน์ตามชื่อ
+            at = {c: i for i, c in enumerate(header)}
+            rows = [[r[at[c]] if c in at else '' for c in local] for r in rows]
+        n = self.db.execute(f"SELECT COUNT(*) FROM {self._t(tab)}").fetchone()[0]
+        self._insert(tab, n, rows)
+        self._bump(tab)
+        return self._enqueue(tab, 'apply', {'header': local, 'size': n, 'changes': {'appends': rows}}).lastrowid
+
+    def _archive(self, archive):
+        ticket = None
+        for h_tab, frame in (archive or {}).items():
+            ticket = self._append_local(h_tab, frame.columns.tolist(), frame.values.tolist())
+        return ticket
+
+    @contextlib.contextmanager
+    def transaction(self):
+        # รวมการบันทึกหลายครั้ง (หลายแท็บ) ให้สำเร็จหรือล้มพร้อมกัน: with store.transaction(): store.save(...); store.save(...)
+        # append/save/rewrite เรียกใช้เองอยู่แล้ว ถ้าซ้อนอยู่ใน transaction ข้างนอกจะไม่ commit แยก
+        with self.lock:
+            if self._in_tx:
+                yield
+                return
+            self.db.execute("BEGIN")
+            self._in_tx = True
+            try:
+                yield
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK"); raise
+            finally:
+                self._in_tx = False
+        self._wake.set()
+
+    def append(self, tab, frame):
+        with self.transaction():
+            return self._append_local(tab, frame.columns.tolist(), frame.values.tolist())
+
+    def save(self, tab, new_safe, base_safe, base_keys, archive=None):
+        # บันทึกเฉพาะส่วนต่างของ new_safe เทียบกับ base_safe (snapshot ที่ผู้ใช้โหลดไป; base_keys = (_rid, _ver) ของแต่ละแถว)
+        # archive = {แท็บประวัติ: แถวที่ย้ายออก} บันทึกใน transaction เดียวกัน (ต่อท้ายประวัติก่อน แล้วค่อยลบจาก Stock)
+        # 🔒 ทุก session เขียนผ่าน lock เดียวกันทีละรายการ: แถวที่ถูกคนอื่นแก้หลังโหลด snapshot จะถูก rebase
+        #    ด้วย rebase_row ถ้ารวมไม่ได้ (หรือแถวนั้นถูกลบ/ย้ายไปแล้ว) จะ raise WriteConflict ทั้งรายการ
+        # new_safe/base_safe ส่งมาแค่บางแถวของ snapshot ก็ได้ (แถวที่แก้/ลบ + แถวเพิ่มที่ index ไม่ซ้ำของเดิม) แถวที่ไม่ได้ส่งมาถือว่าไม่ได้แตะ
+        # คืน ticket ไว้ถามสถานะการส่งขึ้นชีตด้วย status()
+        header = new_safe.columns.tolist()
+        if header != self.header(tab) or base_safe.columns.tolist() != header or not new_safe.index.is_unique:
+            # หัวตารางในชีตเปลี่ยนหลังโหลด / ตารางที่ส่งมาไม่ตรงหัวตาราง -> ให้โหลดใหม่ ห้ามเขียนทับทั้งแผ่นด้วย snapshot เก่า
+            # (rewrite ลบคิวที่ยังไม่ได้ส่งของ session อื่นทิ้งด้วย) ต้องการเขียนทั้งแผ่นจริงๆ ใช้ save_frame(compact=True) / rewrite
+            raise WriteConflict(tab, ["หัวตาราง"])
+        updated, deleted, appended = diff_rows(base_safe, new_safe)
+        if not (updated or deleted or appended or archive): return None
+        # เช็คเวอร์ชัน -> คิดส่วนต่าง -> เขียน ใน lock/transaction เดียวกัน (ปล่อย lock ระหว่างนี้ คนอื่นจะบันทึกแทรกแล้วถูกเขียนทับ)
+        with self.transaction():
+            t = self._t(tab)
+            state = {rid: (pos, ver) for rid, pos, ver in self.db.execute(f"SELECT _rid, _pos, _ver FROM {t}")}
+            # 1. เช็คเวอร์ชันแถวที่จะแก้/ลบ เทียบกับตอนที่โหลด snapshot
+            stale = [i for i in updated + deleted if state.get(base_keys[i][0], (None, None))[1] != base_keys[i][1]]
+            theirs = self._rows_by_rid(tab, [base_keys[i][0] for i in stale])
+            gone = set(deleted)
+            rebased, conflicts = {}, []
+            for i in stale:
+                rid = base_keys[i][0]
+                row = None
+                if i not in gone and rid in theirs:
+                    row = rebase_row(header, base_safe.loc[i].tolist(), new_safe.loc[i].tolist(), theirs[rid], DELTA_COLS.get(tab, []))
+                if row is None: conflicts.append(i)
+                else: rebased[i] = row
+            if conflicts:
+                key_col = next((c for c in indexed_cols(tab) if c in header), None)
+                raise WriteConflict(tab, [base_safe.at[i, key_col] if key_col else f"แถว {i + 2}" for i in conflicts])
+            # 2. แปลงตำแหน่งใน snapshot -> _rid -> ตำแหน่งปัจจุบัน
+            upd = [(base_keys[i][0], rebased.get(i, new_safe.loc[i].tolist())) for i in updated]
+            upd = [(rid, row) for rid, row in upd if theirs.get(rid) != row]
+            dels = [base_keys[i][0] for i in deleted]
+            apps = new_safe.loc[appended].values.tolist()
+            # เนื้อหาเดิมของแถวที่แก้/ลบ -> ตอนส่งขึ้นชีตใช้หาแถวเป้าหมายใหม่ถ้าตำแหน่งเลื่อน (locate_changes)
+            before = self._rows_by_rid(tab, [rid for rid, _ in upd] + dels)
+            changes = {'updates': [(state[rid][0], row) for rid, row in upd],
+                       'deletes': [state[rid][0] for rid in dels], 'appends': apps,
+                       'expect': [(state[rid][0], before[rid]) for rid in [rid for rid, _ in upd] + dels]}
+            ticket = self._archive(archive)
+            if upd or dels or apps:
+                for rid, row in upd: self._update(tab, rid, row)
+                if dels:
+                    self._delete(tab, dels)
+                    self._renumber(tab)
+                if apps: self._insert(tab, len(state) - len(dels), apps)
+                ticket = self._enqueue(tab, 'apply', {'header': header, 'size': len(state), 'changes': changes}).lastrowid
+                self._bump(tab)
+        return ticket
+
+    def save_frame(self, tab, df, base=None, base_keys=(), compact=False):
+        # บันทึกตารางจากแอป: แปลงเป็นข้อความแบบชีต, Stock แยกแถวจ่าย/ทิ้งไปแท็บประวัติ แล้ว save เฉพาะส่วนต่างเทียบ base
+        # (ไม่มี base / compact -> เขียนทั้งแผ่น, หัวตารางเปลี่ยนหลังโหลด -> WriteConflict ดู save)
+        df_safe = to_sheet_frame(df, tab)
+        archive = None
+        # 🗃️ แถวที่จ่าย/ทิ้งแล้วย้ายไปแท็บประวัติรายเดือน แท็บ Stock จะเหลือแต่ยาที่อยู่ในตู้
+        if tab == 'Stock': df_safe, archive = split_history(df_safe)
+        if compact or base is None: return self.rewrite(tab, df_safe, archive)
+        return self.save(tab, df_safe, to_sheet_frame(base, tab), base_keys, archive)
+
+    def rewrite(self, tab, new_safe, archive=None):
+        values = [new_safe.columns.tolist()] + new_safe.values.tolist()
+        with self.transaction():
+            self._archive(archive)
+            self._replace(tab, values[0], values[1:])
+            # เขียนทับทั้งแผ่นแล้ว คิวแก้ไขเก่าของแท็บนี้ไม่มีความหมายอีกต่อไป
+            self.db.execute("DELETE FROM mirror_outbox WHERE tab = ?", (tab,))
+            return self._enqueue(tab, 'rewrite', {'values': values}).lastrowid
+
+    # ---------- ซิงก์กับชีต ----------
+    def push(self):
+        # ส่งคิวขึ้นชีต โดยรวมรายการที่ค้างของแท็บเดียวกันเป็นคำขอเดียว (coalesce_outbox)
+        # ถ้าพังกลางทางให้หยุด แล้วรอบหน้าค่อยส่งต่อจากรายการเดิม
+        # แก้/ลบแถว -> ดึงแท็บนั้นล่าสุดก่อน (รวมทุกแท็บในคำขอเดียว) แล้วหาแถวเป้าหมายใหม่ เผื่อมีคนอื่นเขียนแทรกระหว่างรอส่ง
+        with self.lock:
+            entries = [(i, tab, kind, json.loads(p)) for i, tab, kind, p in
+                       self.db.execute("SELECT id, tab, kind, payload FROM mirror_outbox ORDER BY id").fetchall()]
+        batches = coalesce_outbox(entries)
+        need = sorted({tab for tab, kind, payload, _ in batches if kind == 'apply' and payload['changes'].get('expect')})
+        current = self.remote.fetch(need) if need else {}
+        for tab, kind, payload, ids in batches:
+            if kind == 'rewrite': self.remote.rewrite(tab, payload['values'])
+            else:
+                changes = payload['changes']
+                if changes.get('expect'):
+                    if tab not in current: current.update(self.remote.fetch([tab]))
+                    changes = self._locate(tab, payload['header'], current.get(tab), changes)
+                changes = {k: v for k, v in changes.items() if k != 'expect'}
+                if any(changes.values()): self.remote.apply(tab, payload['header'], changes)
+            current.pop(tab, None)  # แท็บนี้เพิ่งถูกเขียน -> รายการถัดไปของแท็บเดียวกันต้องดึงใหม่
+            with self.lock:
+                self.db.executemany("DELETE FROM mirror_outbox WHERE id = ?", [(i,) for i in ids])
+
+    def _locate(self, tab, header, values, changes):
+        remote = frame_from_values(values or [header])
+        if remote.columns.tolist() != header: return changes  # หัวตารางในชีตเปลี่ยน -> ส่งตามตำแหน่งเดิม
+        changes, conflicts = locate_changes(header, remote.values.tolist(), changes, ROW_KEYS.get(tab, []), DELTA_COLS.get(tab, []))
+        if conflicts:
+            # แถวถูกคนอื่นลบ/แก้ชนกันก่อนส่งถึงชีต -> ใช้ตามชีต (pull รอบถัดไปจะดึงทับสำเนาในเครื่อง) แล้วจดไว้ให้แอปแจ้งผู้ใช้
+            metrics.count('mirror.push_conflict', len(conflicts))
+            with self.lock: self.conflicts.append({'at': time.time(), 'tab': tab, 'keys': conflicts})
+        return changes
+
+    def pull(self, tabs=None):
+        # ดึงชีตทั้งหมดในคำขอเดียว แล้วแก้เฉพาะแถวที่เวอร์ชันไม่ตรง (แถวที่เหมือนเดิมคง _rid ไว้)
+        # คืนรายชื่อแท็บที่ขอไปจริง (แท็บที่ยังมีคิวค้างจะข้ามไปก่อน)
+        with self.lock:
+            busy = {r[0] for r in self.db.execute("SELECT DISTINCT tab FROM mirror_outbox")}
+            stale = [r[0] for r in self.db.execute("SELECT tab FROM mirror_stale")]
+        full = tabs is None
+        tabs = [t for t in (tabs or self.tabs + stale) if t not in busy]
+        # ดึงเต็มรอบ: แท็บประวัติที่มีในเครื่องแล้วอาจถูกเครื่องอื่นต่อท้าย (เช่นงานกวาดยาหมดอายุตอนกลางคืน) -> ดึงเฉพาะแท็บที่เปลี่ยน
+        if full: tabs += self._changed_history([t for t in self._held_history() if t not in busy and t not in tabs])
+        remote = self.remote.fetch(tabs) if tabs else {}
+        with self.lock:
+            busy = {r[0] for r in self.db.execute("SELECT DISTINCT tab FROM mirror_outbox")}
+            for tab, values in remote.items():
+                if tab in busy: continue  # มีคนบันทึกในเครื่องระหว่างที่กำลังดึง รอรอบหน้า
+                df = frame_from_values(values)
+                self.db.execute("BEGIN")
+                try:
+                    self._merge_remote(tab, df.columns.tolist(), df.values.tolist())
+                    self.db.execute("DELETE FROM mirror_stale WHERE tab = ?", (tab,))
+                    self.db.execute("COMMIT")
+                except Exception:
+                    self.db.execute("ROLLBACK"); raise
+            if full:
+                self.last_pull = time.time()
+                self.db.execute("INSERT OR REPLACE INTO mirror_meta VALUES ('last_pull', ?)", (repr(self.last_pull),))
+        return tabs
+
+    def _held_history(self):
+        with self.lock:
+            return [r[0] for r in self.db.execute("SELECT tab FROM mirror_tables WHERE substr(tab, 1, ?) = ? ORDER BY tab",
+                                                  (len(HISTORY_PREFIX), HISTORY_PREFIX))]
+
+    def _changed_history(self, tabs):
+        if not tabs: return []
+        remote = self.remote.probe(tabs)
+        changed = []
+        with self.lock:
+            for t in tabs:
+                if t not in remote: continue  # ยังไม่มีแท็บนี้ในชีต
+                n = min(len(self.header(t) or []), PROBE_COLS)
+                local = [self.header(t)[:n]] + self.db.execute(
+                    f"SELECT {', '.join(f'c{i}' for i in range(n)) or 'NULL'} FROM {self._t(t)} ORDER BY _pos").fetchall() if n else []
+                if probe_digest(remote[t]) != probe_digest(local): changed.append(t)
+        return changed
+
+    def missing(self, tabs):
+        # แท็บที่ยังไม่มีในเครื่อง (หรือมีแต่ยังไม่เคยดึงของจริงจากชีตมาเติม)
+        with self.lock:
+            stale = {r[0] for r in self.db.execute("SELECT tab FROM mirror_stale")}
+            return [t for t in tabs if self.header(t) is None or t in stale]
+
+    def ensure(self, tabs, wait=True):
+        # โหลดแท็บที่ไม่ได้ซิงก์ประจำ (เช่นประวัติรายเดือน) เฉพาะตอนที่มีคนขอดู คืนรายชื่อแท็บที่ยังไม่มีในเครื่อง
+        # wait=False (หน้าเว็บ): ไม่ต่อเน็ตใน thread ของหน้าเว็บ ฝากให้ thread ซิงก์เบื้องหลังโหลดให้ แล้วใช้ของในเครื่องไปก่อน
+        missing = self.missing(tabs)
+        if not missing: return []
+        if not wait:
+            with self.lock: self._wanted.update(missing)
+            self._wake.set()
+            return missing
+        try:
+            fetched = self.pull(missing)
+        except Exception as e:
+            self.last_error = e
+            return missing
+        with self.lock:
+            # แท็บที่ไม่มีในชีตจริง -> จำไว้ว่าว่าง จะได้ไม่ต้องถามซ้ำทุกครั้ง
+            for t in fetched:
+                if self.header(t) is None: self._create(t, [])
+        return self.missing(tabs)
+
+    def _merge_remote(self, tab, header, rows):
+        if header != self.header(tab): return self._replace(tab, header, rows)
+        t = self._t(tab)
+        local = self.db.execute(f"SELECT _rid, _ver FROM {t} ORDER BY _pos").fetchall()
+        l_vers = [v for _, v in local]
+        r_vers = [row_version(r) for r in rows]
+        if l_vers == r_vers: return
+        if len(l_vers) == len(r_vers):
+            # แก้ไขในเซลล์อย่างเดียว (จำนวนแถวเท่าเดิม) -> อัปเดตเฉพาะแถวที่เวอร์ชันเปลี่ยน
+            for (rid, lv), rv, row in zip(local, r_vers, rows):
+                if lv != rv: self._update(tab, rid, row)
+        else:
+            # มีการแทรก/ลบแถวในชีต -> จับคู่ลำดับเวอร์ชันเพื่อรักษา _rid ของแถวที่ไม่เปลี่ยน
+            sm = difflib.SequenceMatcher(None, l_vers, r_vers, autojunk=False)
+            for op, i1, i2, j1, j2 in sm.get_opcodes():
+                if op == 'equal': continue
+                if op == 'replace' and i2 - i1 == j2 - j1:
+                    for k in range(i2 - i1): self._update(tab, local[i1 + k][0], rows[j1 + k])
+                    continue
+                if i2 > i1: self._delete(tab, [local[k][0] for k in range(i1, i2)])
+                if j2 > j1:
+                    # วางแถวใหม่ไว้ระหว่างแถวก่อนหน้า/ถัดไป ด้วยตำแหน่งทศนิยม แล้วค่อยเรียงเลขใหม่ตอนท้าย
+                    lo = i1 - 1 if i1 > 0 else -1
+                    step = 1.0 / (j2 - j1 + 1)
+                    self._insert(tab, 0, rows[j1:j2], positions=[lo + step * (k + 1) for k in range(j2 - j1)])
+            self._renumber(tab)
+        self._bump(tab)
+
+    def sync(self):
+        try:
+            with metrics.timer('mirror.push'): self.push()
+            with metrics.timer('mirror.pull'): self.pull()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = e
+            return
+        # แท็บที่หน้าเว็บฝากโหลดไว้ (ensure(wait=False)) โหลดไม่สำเร็จก็เก็บไว้ลองรอบหน้า
+        with self.lock: wanted = list(self._wanted)
+        if wanted:
+            with metrics.timer('mirror.ensure'): left = self.ensure(wanted)
+            with self.lock: self._wanted.difference_update(set(wanted) - set(left))
+
+    def start(self, interval=30, sync_now=False):
+        # thread เบื้องหลัง: ส่งคิวขึ้นชีตทันทีที่มีการบันทึก และดึงของใหม่จากชีตทุก interval วินาที
+        # sync_now = ซิงก์รอบแรกในเบื้องหลังเลย (เปิดแอปด้วยสำเนาในเครื่องได้ทันที ไม่ต้องรอชีต)
+        if self._thread is not None: return
+        if sync_now: self._wake.set()
+        def loop():
+            while True:
+                # มีคนบันทึก -> รออีกนิดให้รายการที่ตามมาติดๆ เข้าคิวก่อน แล้วส่งรวมกันทีเดียว
+                if self._wake.wait(interval): time.sleep(COALESCE_WINDOW)
+                self._wake.clear()
+                self.sync()
+        self._thread = threading.Thread(target=loop, name="sheet-sync", daemon=True)
+        self._thread.start()
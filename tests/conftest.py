@@ -0,0 +1,31 @@
+# 🧪 ชุดทดสอบรันด้วย  python -m pytest -q  จากโฟลเดอร์หลักของ repo (ไม่ต้องต่อเน็ต ใช้ชีตปลอม MemoryBackend)
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import storage
+
+STOCK_HEADER = ['Date_Produced', 'Drug_Name', 'Batch_ID', 'Qty', 'Expiry_Date', 'Location', 'Status', 'Is_Saved', 'Action_By', 'Record_Status']
+
+def lot(batch, qty, expiry='2026-12-01', drug='Drug A', location='ER', produced='2026-10-01', status='Active', record='In_Stock'):
+    return [produced, drug, batch, str(qty), expiry, location, status, 'TRUE', 'x', record]
+
+@pytest.fixture
+def sheet():
+    # ชีตปลอมที่มีล็อต B0, B1, B2 ในแท็บ Stock (ไม่รอ backoff จริง)
+    guard = storage.QuotaGuard(per_minute=1e9, sleep=lambda s: None)
+    return storage.MemoryBackend({'Stock': [STOCK_HEADER, lot('B0', 5), lot('B1', 10), lot('B2', 8)],
+                                  'Drugs': [['Drug_Name', 'Unit_Cost'], ['Drug A', '2']]}, guard=guard)
+
+@pytest.fixture
+def mirror(sheet):
+    store = storage.SQLiteMirror(':memory:', sheet)
+    store.sync()
+    assert store.last_error is None
+    return store
+
+def qty_of(rows, batch):
+    return [r[3] for r in rows[1:] if r[2] == batch]
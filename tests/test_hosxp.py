@@ -0,0 +1,31 @@
+import hosxp
+from conftest import qty_of
+
+
+def source(tmp_path, rows):
+    path = str(tmp_path / 'feed.db')
+    hosxp.create_standin(path, ['A1'], ['ER'], rows=rows)
+    return hosxp.open_source(f'sqlite:///{path}')
+
+def test_unmapped_records_wait_in_pending_until_code_is_added(mirror, sheet, tmp_path):
+    sheet.tables['Drugs'] = [['Drug_Name', 'Unit_Cost', 'HIS_Code'], ['Drug A', '2', '']]
+    sheet.tables['Locations'] = [['Location'], ['ER']]
+    mirror.sync()
+    feed = source(tmp_path, 4)
+    report = hosxp.run_import(mirror, feed)
+    assert report['last_id'] == 4 and report['unmapped'] == {'A1 @ER': 4} and report['pending'] == 4
+    assert report['dispensed'] == 0 and hosxp.last_id(mirror) == 4
+    mirror.sync()
+    assert len(sheet.tables[hosxp.PENDING_TAB]) == 5
+
+    sheet.tables['Drugs'][1][2] = 'A1'  # เพิ่ม HIS_Code ทีหลัง
+    mirror.sync()
+    report = hosxp.run_import(mirror, feed)
+    assert report['records'] == 0 and report['retried'] == 4 and report['pending'] == 0
+    dispensed = report['dispensed']
+    assert dispensed > 0
+    mirror.sync()
+    assert sheet.tables[hosxp.PENDING_TAB][1:] == []
+    left = sum(float(q) for b in ('B0', 'B1', 'B2') for q in qty_of(sheet.tables['Stock'], b))
+    assert left == 23 - dispensed
+    assert hosxp.run_import(mirror, feed)['retried'] == 0  # ไม่ตัดซ้ำ
@@ -0,0 +1,99 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import inventory
+
+TODAY = datetime(2026, 10, 17, 9, 30)
+WARDS = ['ER', 'ICU', 'OPD']
+
+
+def stock_frame(n=300, seed=0):
+    # สต็อกสุ่มแบบที่ได้จาก enrich_stock: มีทั้งล็อตหมดอายุแล้ว / ไม่มีวันหมดอายุ / ยาแช่แข็ง / แถวที่จ่ายไปแล้ว
+    rng = np.random.default_rng(seed)
+    expiry = pd.Timestamp(TODAY.date()) + pd.to_timedelta(rng.integers(-10, 60, n), unit='D')
+    return pd.DataFrame({
+        'Date_Produced': pd.Timestamp(TODAY.date()) - pd.to_timedelta(rng.integers(0, 60, n), unit='D'),
+        'Drug_Name': [f"Drug {i}" for i in rng.integers(0, 12, n)], 'Batch_ID': [f"B{i}" for i in range(n)],
+        'Qty': rng.integers(0, 40, n).astype(float), 'Expiry_Date': expiry.where(rng.random(n) > 0.05),
+        'Location': rng.choice(WARDS, n), 'Status': rng.choice(['Active', 'Frozen', 'Thawed'], n),
+        'Action_By': rng.choice(['a', 'b'], n), 'Record_Status': rng.choice(['In_Stock'] * 8 + ['Dispensed', 'Disposed'], n),
+        'Type': rng.choice(['Frozen', 'Room'], n), 'Unit_Cost': rng.random(n) * 10,
+    })
+
+
+def test_expiry_buckets_match_per_row_days_left():
+    stock = inventory.compact(stock_frame())
+    index = inventory.ExpiryIndex(stock)
+    # วิธีเดิม: คิด Days_Left ทุกแถวแล้วกรองทีละเงื่อนไข
+    live = stock[stock['Record_Status'] == 'In_Stock']
+    frozen = (live['Type'] == 'Frozen') & (live['Status'] == 'Frozen')
+    left = inventory.days_left(live['Expiry_Date'], TODAY)
+    for wards in (['ER'], ['ICU', 'OPD'], WARDS, ['nowhere']):
+        for group, mask in (('frozen', frozen), ('ready', ~frozen)):
+            for days in (0, 7, 30):
+                old = live[live['Location'].isin(wards) & mask & (left <= days)]
+                new = index.expiring(wards, group, TODAY, days)
+                assert sorted(new['Batch_ID']) == sorted(old['Batch_ID'])
+                assert new['Expiry_Date'].is_monotonic_increasing
+                assert dict(zip(new['Batch_ID'], new['Days_Left'])) == dict(zip(old['Batch_ID'], left[old.index]))
+    # ล็อตที่ไม่มีวันหมดอายุไม่ติดแจ้งเตือน แต่ยังอยู่ในรายการทั้งหมดของถัง
+    undated = live[live['Expiry_Date'].isna() & ~frozen & (live['Location'] == 'ER')]['Batch_ID']
+    assert set(undated) <= set(index.upto(['ER'], 'ready')['Batch_ID'])
+
+def test_compact_round_trips_without_changing_values():
+    stock = stock_frame()
+    small = inventory.compact(stock)
+    assert all(isinstance(small[c].dtype, pd.CategoricalDtype) for c in inventory.CATEGORY_COLS)
+    assert small['Qty'].dtype == 'int32' and small['Expiry_Date'].dtype == stock['Expiry_Date'].dtype
+    assert small.memory_usage(deep=True).sum() < stock.memory_usage(deep=True).sum()
+    back = inventory.editable(small)
+    pd.testing.assert_frame_equal(back, stock)
+    # Qty มีเศษ -> คง float ไว้ ไม่ปัดทิ้ง
+    stock.loc[0, 'Qty'] = 2.5
+    assert inventory.compact(stock)['Qty'].tolist() == stock['Qty'].tolist()
+
+def check_stock_index(index, stock):
+    # เทียบดัชนีกับการกรองตารางตรงๆ ทีละหน่วยงาน
+    live = stock[(stock['Record_Status'] == 'In_Stock') & (stock['Qty'] > 0)]
+    for ward in WARDS:
+        mine = live[live['Location'] == ward].sort_values('Expiry_Date', kind='stable', na_position='last')
+        assert index.drugs(ward) == mine.groupby('Drug_Name', observed=True)['Qty'].sum().sort_index().to_dict()
+        assert [b for _, b in index.batches(ward)] == mine['Batch_ID'].tolist()
+        for key in index.batches(ward):
+            row = stock.loc[index.row[key]]
+            assert (row['Location'], row['Batch_ID']) == key and index.lots[key] == (row['Drug_Name'], row['Qty'])
+        expired = mine[inventory.days_left(mine['Expiry_Date'], TODAY) < 0]['Batch_ID']
+        assert [b for _, b in index.expired(ward, TODAY)] == expired.tolist()
+
+def test_stock_index_follows_edits_to_a_new_version():
+    import stock_ops
+    v1 = inventory.compact(stock_frame())
+    old = inventory.StockIndex(v1)
+    check_stock_index(old, v1)
+    # จ่ายยาจนบางล็อตหมด (แถวเปลี่ยนสถานะ + แตกแถว) -> ข้อมูลเวอร์ชันใหม่ได้ดัชนีใหม่
+    ward, drug = 'ER', next(iter(old.drugs('ER')))
+    edited, _ = stock_ops.allocate_fefo(inventory.editable(v1), [{'Location': ward, 'Drug_Name': drug, 'Qty': old.drugs(ward)[drug] - 1}], 'u')
+    v2 = inventory.compact(edited)
+    new = inventory.StockIndex(v2)
+    check_stock_index(new, v2)
+    assert new.drugs(ward)[drug] == 1 and len(new.batches(ward, drug)) == 1
+    # ดัชนีของเวอร์ชันเดิมยังตรงกับข้อมูลเดิม (session ที่ยังเปิดเวอร์ชันเก่าอยู่ไม่พัง)
+    check_stock_index(old, v1)
+
+def test_stock_totals_keeps_top_drugs_and_groups_the_rest():
+    stock = inventory.compact(stock_frame())
+    live = stock[stock['Record_Status'] == 'In_Stock']
+    per_drug = live.groupby('Drug_Name', observed=True)['Qty'].sum()
+    per_drug = per_drug[per_drug != 0].sort_values(ascending=False, kind='stable')
+    out = inventory.stock_totals(stock, top_n=5)
+    names = list(dict.fromkeys(out['Drug_Name']))
+    # 5 ยายอดรวมมากสุดเรียงจากมากไปน้อย ตามด้วยแท่ง "อื่นๆ" แท่งเดียวท้ายสุด
+    assert names[:5] == per_drug.index[:5].tolist()
+    assert names[5:] == [f"{inventory.OTHER} ({len(per_drug) - 5} รายการ)"]
+    # ยอดรวมไม่หายไปไหน ทั้งต่อหน่วยงานและทั้งหมด
+    assert out.groupby('Location')['Qty'].sum().to_dict() == live.groupby('Location', observed=True)['Qty'].sum().astype(float).to_dict()
+    assert len(out) <= 6 * len(WARDS)
+    # ยาไม่ถึง top_n -> ไม่มีแท่งอื่นๆ
+    assert not inventory.stock_totals(stock, top_n=50)['Drug_Name'].str.startswith(inventory.OTHER).any()
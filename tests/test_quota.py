@@ -0,0 +1,85 @@
+import pytest
+
+import storage
+
+
+class Clock:
+    # นาฬิกาปลอม: sleep แค่เลื่อนเวลา ไม่รอจริง
+    def __init__(self): self.t, self.slept = 0.0, []
+    def __call__(self): return self.t
+    def sleep(self, s): self.slept.append(s); self.t += s
+
+def guard(clock, **kw):
+    kw = {'per_minute': 1e9, 'retries': 2, 'failures': 2, 'cooldown': 60, 'clock': clock, 'sleep': clock.sleep, 'rnd': lambda: 0.5, **kw}
+    return storage.QuotaGuard(**kw)
+
+def flaky(fails):
+    # ล้มด้วย 429 fails ครั้งแรก แล้วสำเร็จ
+    calls = []
+    def fn():
+        calls.append(1)
+        if len(calls) <= fails: raise storage.quota_error()
+        return 'ok'
+    return fn, calls
+
+
+def test_retries_with_backoff_then_succeeds():
+    clock = Clock()
+    fn, calls = flaky(2)
+    assert guard(clock).call(fn) == 'ok'
+    assert len(calls) == 3 and clock.slept == [0.5, 1.0]
+
+def test_breaker_opens_after_repeated_failures_and_recovers():
+    clock = Clock()
+    g = guard(clock)
+    fn, calls = flaky(100)
+    for _ in range(2):
+        with pytest.raises(Exception): g.call(fn)
+    assert g.state() == 'open'
+    n = len(calls)
+    with pytest.raises(storage.RemoteUnavailable): g.call(fn)
+    assert len(calls) == n  # ตัดวงจรอยู่ ไม่ยิงคำขอ
+    clock.t += 61
+    assert g.state() == 'half-open'
+    ok, _ = flaky(0)
+    assert g.call(ok) == 'ok' and g.state() == 'closed'
+
+def test_non_idempotent_calls_do_not_retry_server_errors():
+    import requests
+    clock = Clock()
+    resp = requests.Response(); resp.status_code = 503
+    calls = []
+    def append():
+        calls.append(1)
+        err = OSError("503"); err.response = resp
+        raise err
+    with pytest.raises(OSError): guard(clock).call(append, idempotent=False)
+    assert len(calls) == 1
+
+def test_budget_too_far_ahead_raises_without_calling():
+    clock = Clock()
+    g = guard(clock, per_minute=6, burst=1, max_wait=5)
+    fn, calls = flaky(0)
+    g.call(fn)
+    with pytest.raises(storage.RemoteUnavailable): g.call(fn)
+    assert len(calls) == 1
+
+def test_half_open_lets_exactly_one_trial_through():
+    import threading
+    clock = Clock()
+    g = guard(clock)
+    fn, _ = flaky(100)
+    for _ in range(2):
+        with pytest.raises(Exception): g.call(fn)
+    clock.t += 61
+    started, release, calls = threading.Event(), threading.Event(), []
+    def trial():
+        calls.append(1); started.set(); release.wait(5)
+        raise storage.quota_error()
+    t = threading.Thread(target=lambda: pytest.raises(Exception, g.call, trial))
+    t.start(); started.wait(5)
+    for _ in range(5):
+        with pytest.raises(storage.RemoteUnavailable): g.call(trial)
+    release.set(); t.join()
+    assert len(calls) == 1  # คำขอทดลองไม่ลองซ้ำ และคนอื่นไม่ได้ยิงระหว่างรอผล
+    assert g.state() == 'open' and not g.trial
@@ -0,0 +1,46 @@
+from datetime import date, timedelta
+
+import pandas as pd
+
+import redistribute
+
+TODAY = date(2026, 10, 17)
+
+
+def stock_frame(*lots):
+    # lots = (หน่วยงาน, ยา, batch, จำนวน, หมดอายุอีกกี่วัน)
+    return pd.DataFrame({
+        'Location': [l[0] for l in lots], 'Drug_Name': [l[1] for l in lots], 'Batch_ID': [l[2] for l in lots],
+        'Qty': [float(l[3]) for l in lots], 'Record_Status': ['In_Stock'] * len(lots), 'Status': ['Active'] * len(lots),
+        'Expiry_Date': [pd.Timestamp(TODAY + timedelta(days=l[4])) for l in lots],
+    })
+
+def rates(**per_ward):
+    return pd.Series({(ward, 'A'): float(r) for ward, r in per_ward.items()}).rename_axis(redistribute.KEYS)
+
+
+def test_surplus_goes_to_wards_that_can_use_it_before_expiry():
+    # ER ใช้วันละ 1 แต่มี 100 หมดอายุใน 10 วัน -> เหลือทิ้ง 90, ICU ใช้ทัน 50, OPD มีล็อตเองอยู่แล้วแต่ยังรับได้อีก 20
+    stock = stock_frame(('ER', 'A', 'e1', 100, 10), ('OPD', 'A', 'o1', 10, 30))
+    plan = redistribute.recommend(stock, rates(ER=1, ICU=5, OPD=2), TODAY, horizon=30)
+    assert plan[['Batch_ID', 'From', 'To', 'Qty']].values.tolist() == [['e1', 'ER', 'ICU', 50], ['e1', 'ER', 'OPD', 20]]
+    assert plan['Waste'].eq(90).all()
+    # ล็อตของ OPD ใช้ทันอยู่แล้ว ไม่ถูกแนะนำให้โอนออก
+    assert 'o1' not in plan['Batch_ID'].tolist()
+
+def test_earliest_expiry_gets_the_receiving_capacity_first():
+    # ICU ใช้วันละ 1: ล็อต early (8 วัน) ได้ 8 ก่อน ล็อต late (12 วัน) ได้ส่วนที่เหลือ 12 - 8 = 4
+    stock = stock_frame(('ER', 'A', 'late', 20, 12), ('ER', 'A', 'early', 20, 8))
+    plan = redistribute.recommend(stock, rates(ICU=1), TODAY, horizon=30)
+    assert plan.set_index('Batch_ID')['Qty'].to_dict() == {'early': 8, 'late': 4}
+    assert set(plan['To']) == {'ICU'}
+
+def test_zero_rate_wards_never_receive_and_waste_everything():
+    dispensed = pd.DataFrame({'Location': ['ICU', 'OPD'], 'Drug_Name': ['A', 'A'], 'Qty': [0.0, 90.0]})
+    r = redistribute.consumption_rates(dispensed, 90)
+    assert r.to_dict() == {('OPD', 'A'): 1.0}
+    stock = stock_frame(('ER', 'A', 'e1', 50, 10), ('ICU', 'A', 'i1', 5, 10))
+    plan = redistribute.recommend(stock, r, TODAY, horizon=30)
+    # ER / ICU ไม่มียอดใช้ -> ทั้งล็อตคือยาทิ้ง, OPD รับได้ 10 (แบ่งให้ล็อตที่เข้าคิวก่อน), ICU ไม่ถูกเลือกเป็นปลายทาง
+    assert plan[['Batch_ID', 'To', 'Qty', 'Waste']].values.tolist() == [['e1', 'OPD', 10, 50.0]]
+    assert redistribute.recommend(stock, r.iloc[:0], TODAY).columns.tolist() == redistribute.COLS
@@ -0,0 +1,41 @@
+import pandas as pd
+
+import stock_ops
+
+
+def stock_frame():
+    return pd.DataFrame({
+        'Drug_Name': ['A', 'A', 'A', 'B'], 'Batch_ID': ['late', 'early', 'none', 'b1'], 'Location': ['ER'] * 4,
+        'Qty': [5.0, 4.0, 10.0, 3.0], 'Record_Status': ['In_Stock'] * 4, 'Status': ['Active'] * 4, 'Action_By': [''] * 4,
+        'Expiry_Date': pd.to_datetime(['2026-12-01', '2026-11-01', None, '2026-11-15']),
+    })
+
+
+def test_fefo_takes_earliest_expiry_first_and_splits_partial_lot():
+    new, summary = stock_ops.allocate_fefo(stock_frame(), [{'Location': 'ER', 'Drug_Name': 'A', 'Qty': 6}], 'u')
+    live = new[new['Record_Status'] == 'In_Stock'].set_index('Batch_ID')['Qty']
+    assert live.to_dict() == {'late': 3.0, 'none': 10.0, 'b1': 3.0}
+    out = new[new['Record_Status'] == 'Dispensed'].set_index('Batch_ID')['Qty']
+    assert out.to_dict() == {'early': 4.0, 'late': 2.0}
+    assert summary[['Dispensed', 'Short']].values.tolist() == [[6.0, 0.0]]
+
+def test_fefo_reports_shortage_and_lots_without_expiry_go_last():
+    new, summary = stock_ops.allocate_fefo(stock_frame(), [{'Location': 'ER', 'Drug_Name': 'A', 'Qty': 15},
+                                                           {'Location': 'ER', 'Drug_Name': 'B', 'Qty': 5}], 'u')
+    assert new.loc[new['Batch_ID'] == 'none', 'Qty'].tolist() == [4.0, 6.0]
+    assert summary.set_index('Drug_Name')['Short'].to_dict() == {'A': 0.0, 'B': 2.0}
+    assert len(new) == 5  # แถวจ่ายบางส่วนเพิ่มแค่แถวเดียว (ล็อต none)
+
+def test_fefo_leaves_other_wards_untouched():
+    stock = pd.concat([stock_frame(), stock_frame().assign(Location='ICU')], ignore_index=True)
+    new, _ = stock_ops.allocate_fefo(stock, [{'Location': 'ICU', 'Drug_Name': 'A', 'Qty': 4}], 'u')
+    assert (new[new['Location'] == 'ER']['Record_Status'] == 'In_Stock').all()
+
+def test_manifest_rejects_batches_already_received_into_history():
+    from datetime import datetime
+    drugs = pd.DataFrame({'Drug_Name': ['A']})
+    manifest = pd.DataFrame({'Drug_Name': ['A', 'A', 'A'], 'Batch_ID': ['old', 'late', 'new'], 'Qty': ['5'] * 3, 'Location': ['ER'] * 3})
+    out = stock_ops.receive_manifest(manifest, drugs, stock_frame(), ['ER'], 'u', datetime(2026, 10, 17),
+                                     received=lambda batches: {'old'} & set(batches))
+    assert out.set_index('Batch_ID')['Problem'].to_dict() == {
+        'old': 'เลข Batch นี้เคยรับเข้าแล้ว (อยู่ในประวัติจ่าย/ทิ้ง)', 'late': 'มีเลข Batch นี้ในสต็อกแล้ว', 'new': ''}
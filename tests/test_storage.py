@@ -0,0 +1,245 @@
+import pytest
+
+import storage
+from conftest import STOCK_HEADER, lot, qty_of
+
+
+def set_qty(df, batch, qty):
+    new = df.copy()
+    new.loc[new['Batch_ID'] == batch, 'Qty'] = str(qty)
+    return new
+
+
+# --- rebase_row ---
+def test_rebase_row_adds_up_qty_deltas():
+    base, mine, theirs = lot('B1', 10), lot('B1', 7), lot('B1', 4)
+    assert storage.rebase_row(STOCK_HEADER, base, mine, theirs, ['Qty'])[3] == '1'
+
+def test_rebase_row_rejects_overdraw_and_clashing_cells():
+    assert storage.rebase_row(STOCK_HEADER, lot('B1', 10), lot('B1', 4), lot('B1', 3), ['Qty']) is None
+    base = lot('B1', 10)
+    mine, theirs = lot('B1', 10, location='ICU'), lot('B1', 10, location='OPD')
+    assert storage.rebase_row(STOCK_HEADER, base, mine, theirs, ['Qty']) is None
+    # แก้คนละช่อง -> รวมกันได้
+    out = storage.rebase_row(STOCK_HEADER, base, lot('B1', 10, location='ICU'), lot('B1', 10, status='Thawed'), ['Qty'])
+    assert out[5] == 'ICU' and out[6] == 'Thawed'
+
+
+# --- การเช็คเวอร์ชันแถวตอนบันทึก ---
+def test_stale_snapshot_is_rebased(mirror, sheet):
+    df, keys = mirror.read('Stock')
+    mirror.save('Stock', set_qty(df, 'B1', 7), df, keys)
+    mirror.save('Stock', set_qty(df, 'B1', 4), df, keys)  # snapshot เดิมก่อนอีกคนบันทึก
+    now, _ = mirror.read('Stock')
+    assert now.loc[now['Batch_ID'] == 'B1', 'Qty'].tolist() == ['1']
+    mirror.push()
+    assert qty_of(sheet.tables['Stock'], 'B1') == ['1']
+
+def test_conflicting_edit_raises_and_writes_nothing(mirror):
+    df, keys = mirror.read('Stock')
+    mirror.save('Stock', set_qty(df, 'B1', 2), df, keys)
+    before = mirror.pending()
+    with pytest.raises(storage.WriteConflict) as e:
+        mirror.save('Stock', set_qty(df, 'B1', 1).assign(Qty=lambda d: d['Qty'].where(d['Batch_ID'] != 'B0', '0')), df, keys)
+    assert e.value.keys == ['B1']
+    now, _ = mirror.read('Stock')
+    assert now['Qty'].tolist() == ['5', '2', '8'] and mirror.pending() == before
+
+def test_header_change_after_load_conflicts_instead_of_rewriting(mirror, sheet):
+    # session A โหลด snapshot ไว้ -> หัวตารางในชีตเปลี่ยน -> session B แก้บน snapshot ใหม่ (ค้างคิว) -> A บันทึกต้องล้ม ไม่ทับคิวของ B
+    old, old_keys = mirror.read('Stock')
+    sheet.tables['Stock'] = [STOCK_HEADER + ['Note']] + [r + [''] for r in sheet.tables['Stock'][1:]]
+    mirror.sync()
+    df, keys = mirror.read('Stock')
+    mirror.save('Stock', set_qty(df, 'B1', 9), df, keys)  # session B
+    queued = mirror.pending()
+    with pytest.raises(storage.WriteConflict):
+        mirror.save('Stock', set_qty(old, 'B2', 1), old, old_keys)  # session A
+    with pytest.raises(storage.WriteConflict):
+        mirror.save_frame('Stock', set_qty(old, 'B2', 1), old, old_keys)
+    assert mirror.pending() == queued
+    mirror.push()
+    assert qty_of(sheet.tables['Stock'], 'B1') == ['9'] and qty_of(sheet.tables['Stock'], 'B2') == ['8']
+
+def test_compact_still_rewrites_the_whole_tab(mirror, sheet):
+    df, _ = mirror.read('Stock')
+    mirror.save_frame('Stock', set_qty(df, 'B2', 1), compact=True)
+    mirror.push()
+    assert qty_of(sheet.tables['Stock'], 'B2') == ['1']
+
+def test_edit_of_deleted_row_conflicts(mirror):
+    df, keys = mirror.read('Stock')
+    mirror.save('Stock', df[df['Batch_ID'] != 'B1'], df, keys)
+    with pytest.raises(storage.WriteConflict):
+        mirror.save('Stock', set_qty(df, 'B1', 3), df, keys)
+
+
+# --- รวมคิวก่อนส่ง ---
+def test_coalesce_outbox_merges_positions_against_first_base():
+    hdr = ['k']
+    entries = [(1, 'T', 'apply', {'header': hdr, 'size': 3, 'changes': {'deletes': [0]}}),
+               (2, 'T', 'apply', {'header': hdr, 'size': 2, 'changes': {'updates': [(1, ['c2'])], 'appends': [['d']]}})]
+    [(tab, kind, payload, ids)] = storage.coalesce_outbox(entries)
+    assert (tab, kind, ids) == ('T', 'apply', [1, 2])
+    assert payload['changes'] == {'updates': [(2, ['c2'])], 'deletes': [0], 'appends': [['d']]}
+    rows = storage.apply_changes([['a'], ['b'], ['c']], payload['changes'])
+    assert rows == [['b'], ['c2'], ['d']]
+
+def test_coalesce_outbox_folds_edits_into_rewrite():
+    entries = [(1, 'T', 'rewrite', {'values': [['k'], ['a'], ['b']]}),
+               (2, 'T', 'apply', {'header': ['k'], 'size': 2, 'changes': {'deletes': [0], 'appends': [['c']]}})]
+    assert storage.coalesce_outbox(entries) == [('T', 'rewrite', {'values': [['k'], ['b'], ['c']]}, [1, 2])]
+
+def test_many_saves_push_as_one_apply(mirror, sheet):
+    for qty in (9, 8, 7):
+        df, keys = mirror.read('Stock')
+        mirror.save('Stock', set_qty(df, 'B0', qty), df, keys)
+    sheet.calls.clear()
+    mirror.push()
+    assert [c for c in sheet.calls if c[0] == 'apply'] == [('apply', 'Stock')]
+    assert sheet.tables['Stock'][1:] == [list(r) for r in mirror.read('Stock')[0].values.tolist()]
+
+
+# --- บันทึกพร้อมกันหลาย session ---
+def test_save_elsewhere_cannot_slip_between_check_and_write(mirror, sheet, monkeypatch):
+    # อีก session บันทึกแทรกตอนที่ session นี้เช็คเวอร์ชันเสร็จแล้วแต่ยังไม่ได้เขียน -> ต้องไม่ถูกเขียนทับ
+    df, keys = mirror.read('Stock')
+    tx, injected = mirror.transaction, []
+    def transaction():
+        if not injected:
+            injected.append(1)
+            mirror.save('Stock', set_qty(df, 'B1', 7), df, keys)  # จ่าย 3
+        return tx()
+    monkeypatch.setattr(mirror, 'transaction', transaction)
+    mirror.save('Stock', set_qty(df, 'B1', 4), df, keys)  # จ่าย 6 จาก snapshot เดียวกัน
+    assert mirror.read('Stock')[0].set_index('Batch_ID').at['B1', 'Qty'] == '1'
+    mirror.push()
+    assert qty_of(sheet.tables['Stock'], 'B1') == ['1']
+
+def test_parallel_dispenses_from_one_snapshot_all_count(mirror):
+    import threading
+    df, keys = mirror.read('Stock')
+    start = threading.Barrier(8)
+    errors = []
+    def dispense():
+        start.wait()
+        try: mirror.save('Stock', set_qty(df, 'B1', 9), df, keys)
+        except Exception as e: errors.append(e)
+    threads = [threading.Thread(target=dispense) for _ in range(8)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert not errors
+    assert mirror.read('Stock')[0].set_index('Batch_ID').at['B1', 'Qty'] == '2'
+
+
+# --- สองเครื่องเขียนชีตเดียวกัน (แอป + jobs.py มีสำเนาในเครื่องแยกกัน) ---
+def second_mirror(sheet):
+    other = storage.SQLiteMirror(':memory:', sheet)
+    other.sync()
+    return other
+
+def test_queued_update_follows_row_after_other_writer_deletes_above(mirror, sheet):
+    df, keys = mirror.read('Stock')
+    mirror.save('Stock', set_qty(df, 'B1', 9), df, keys)  # ค้างคิว (ออฟไลน์) อ้างแถวที่ 1
+    other = second_mirror(sheet)
+    o_df, o_keys = other.read('Stock')
+    other.save('Stock', o_df[o_df['Batch_ID'] != 'B0'], o_df, o_keys)
+    other.push()
+    mirror.sync()
+    assert [(r[2], r[3]) for r in sheet.tables['Stock'][1:]] == [('B1', '9'), ('B2', '8')]
+    assert mirror.read('Stock')[0][['Batch_ID', 'Qty']].values.tolist() == [['B1', '9'], ['B2', '8']]
+    assert not mirror.conflicts
+
+def test_queued_update_is_rebased_on_other_writers_edit(mirror, sheet):
+    df, keys = mirror.read('Stock')
+    mirror.save('Stock', set_qty(df, 'B1', 9), df, keys)  # จ่าย 1
+    other = second_mirror(sheet)
+    o_df, o_keys = other.read('Stock')
+    other.save('Stock', set_qty(o_df, 'B1', 7), o_df, o_keys)  # อีกเครื่องจ่าย 3
+    other.push()
+    mirror.push()
+    assert qty_of(sheet.tables['Stock'], 'B1') == ['6']
+
+def test_queued_update_of_row_removed_elsewhere_is_dropped_not_misplaced(mirror, sheet):
+    df, keys = mirror.read('Stock')
+    mirror.save('Stock', set_qty(df, 'B1', 9), df, keys)
+    other = second_mirror(sheet)
+    o_df, o_keys = other.read('Stock')
+    other.save('Stock', o_df[o_df['Batch_ID'] != 'B1'], o_df, o_keys)
+    other.push()
+    mirror.sync()
+    assert [r[2] for r in sheet.tables['Stock'][1:]] == ['B0', 'B2'] and qty_of(sheet.tables['Stock'], 'B2') == ['8']
+    assert [c['keys'] for c in mirror.conflicts] == [['B1']]
+    assert mirror.read('Stock')[0]['Batch_ID'].tolist() == ['B0', 'B2']  # ดึงตามชีตกลับมาแล้ว
+
+def test_nightly_sweep_then_queued_dispense_keeps_every_lot(sheet):
+    from datetime import datetime
+    import jobs
+    sheet.tables['Stock'][1][4] = '2026-01-01'  # B0 หมดอายุแล้ว
+    app = storage.SQLiteMirror(':memory:', sheet)
+    app.sync()
+    df, keys = app.read('Stock')
+    app.save('Stock', set_qty(df, 'B1', 9), df, keys)  # แอปออฟไลน์ ค้างคิวไว้
+    night = second_mirror(sheet)
+    report = jobs.sweep(night, datetime(2026, 10, 17))
+    night.push()
+    assert report['lots'] == 1
+    app.sync()
+    assert [(r[2], r[3]) for r in sheet.tables['Stock'][1:]] == [('B1', '9'), ('B2', '8')]
+
+def test_coalesced_edits_keep_the_first_expected_content():
+    hdr = ['k', 'v']
+    entries = [(1, 'T', 'apply', {'header': hdr, 'size': 2, 'changes': {'updates': [(1, ['b', '2'])], 'expect': [(1, ['b', '1'])]}}),
+               (2, 'T', 'apply', {'header': hdr, 'size': 2, 'changes': {'updates': [(1, ['b', '3'])], 'expect': [(1, ['b', '2'])]}})]
+    [(_, _, payload, _)] = storage.coalesce_outbox(entries)
+    assert payload['changes']['expect'] == [(1, ['b', '1'])]
+    changes, conflicts = storage.locate_changes(hdr, [['x', '0'], ['a', '0'], ['b', '1']], payload['changes'], ['k'])
+    assert changes['updates'] == [(2, ['b', '3'])] and not conflicts
+
+
+# --- แท็บประวัติที่เครื่องอื่นเขียนเพิ่ม ---
+def disposed(store):
+    r = store.rollup('2026-10-01', '2026-10-31', ['ER'])
+    return r.loc[r['Record_Status'] == 'Disposed', 'Qty'].sum()
+
+@pytest.mark.parametrize('existing', [True, False])
+def test_history_written_by_nightly_sweep_reaches_app_rollup(sheet, existing):
+    from datetime import datetime
+    import jobs
+    if existing: sheet.tables['History_2026_10'] = [STOCK_HEADER, lot('H0', 2, record='Dispensed')]
+    sheet.tables['Stock'][1][4] = '2026-01-01'  # B0 (5 หน่วย) หมดอายุแล้ว
+    app = storage.SQLiteMirror(':memory:', sheet)
+    app.sync()
+    app.ensure(['History_2026_10'])
+    assert disposed(app) == 0
+    night = storage.SQLiteMirror(':memory:', sheet)
+    night.sync()
+    jobs.sweep(night, datetime(2026, 10, 17))
+    night.push()
+    app.sync()
+    assert disposed(app) == 5
+    assert app.read('History_2026_10')[0]['Batch_ID'].tolist() == (['H0', 'B0'] if existing else ['B0'])
+
+def test_unchanged_history_is_only_probed(mirror, sheet):
+    sheet.tables['History_2026_10'] = [STOCK_HEADER, lot('H0', 2, record='Dispensed')]
+    mirror.ensure(['History_2026_10'])
+    sheet.calls.clear()
+    mirror.sync()
+    assert sheet.calls == [('probe', ('History_2026_10',)), ('fetch', tuple(storage.TABS))]
+
+def test_ensure_without_wait_leaves_network_to_sync(mirror, sheet):
+    sheet.tables['History_2026_10'] = [STOCK_HEADER, lot('H0', 2, record='Dispensed')]
+    sheet.calls.clear()
+    assert mirror.ensure(['History_2026_10'], wait=False) == ['History_2026_10']
+    assert sheet.calls == [] and mirror.header('History_2026_10') is None  # หน้าเว็บไม่ต้องรอเน็ต
+    mirror.sync()
+    assert mirror.missing(['History_2026_10']) == []
+    assert mirror.read('History_2026_10')[0]['Batch_ID'].tolist() == ['H0']
+    assert mirror.ensure(['History_2026_10'], wait=False) == []
+
+def test_received_batches_covers_stock_and_held_history(mirror, sheet):
+    sheet.tables['History_2026_10'] = [STOCK_HEADER, lot('H0', 2, record='Dispensed')]
+    mirror.ensure(['History_2026_10'])
+    assert mirror.received_batches(['B1', 'H0', 'NEW', '']) == {'B1', 'H0'}
+    plan = mirror.db.execute('EXPLAIN QUERY PLAN SELECT c2 FROM "t_History_2026_10" WHERE c2 IN (SELECT value FROM json_each(?))', ('[]',)).fetchall()
+    assert any('ix_History_2026_10_Batch_ID' in r[-1] for r in plan)